@@ -0,0 +1,46 @@
+#
+# Benchmarks for drconverters.drkinefold (run with asv).
+#
+import os
+import time
+import tempfile
+
+from drconverters.utils import get_drf_output_times
+from drconverters.drkinefold import parse_kinefold_structure, rnm_to_drf
+
+from .fakesim import random_sequence, write_rnm
+
+
+class KinefoldConversion:
+    """Throughput of the Kinefold *.rnm parser on long transcripts."""
+    params = [200, 1000, 3000]
+    param_names = ['seqlen']
+    timeout = 300
+
+    def setup(self, seqlen):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.rnmfile = os.path.join(self.tmpdir.name, 'bench.rnm')
+        self.seq = random_sequence(seqlen)
+        write_rnm(self.rnmfile, 'bench', self.seq, post = 50)
+        with open(self.rnmfile) as rnm:
+            lines = rnm.read().splitlines()[2:]
+        self.snapshots = [(l1.split('|')[0].rstrip(), l2.split('H')[0].rstrip()) 
+                          for l1, l2 in zip(lines[::2], lines[1::2])]
+        self.times = get_drf_output_times(seqlen, 0.02, 30, 10, 30)
+
+    def teardown(self, seqlen):
+        self.tmpdir.cleanup()
+
+    def time_parse_kinefold_structure(self, seqlen):
+        for line1, line2 in self.snapshots:
+            parse_kinefold_structure(line1, line2)
+
+    def time_rnm_to_drf(self, seqlen):
+        rnm_to_drf(self.rnmfile, self.rnmfile[:-3] + 'drf', self.times, 0.02, 10)
+
+    def track_structures_per_second(self, seqlen):
+        start = time.perf_counter()
+        for line1, line2 in self.snapshots:
+            parse_kinefold_structure(line1, line2)
+        return len(self.snapshots) / (time.perf_counter() - start)
+    track_structures_per_second.unit = 'structures/s'
@@ -0,0 +1,110 @@
+#
+# Benchmarks for drconverters.drkinfold (run with asv).
+#
+# Kinfold and Kinefold are replaced by the synthetic simulators in
+# fake_kinfold.py and fake_kinefold.py, so the benchmarks measure the
+# parsing, counting and combining overhead of the wrappers.
+#
+import os
+import sys
+import random
+import tempfile
+import subprocess
+
+from drconverters.utils import get_drf_output_times, open_trajectory_writer, combine_drfs
+from drconverters.drkinfold import run_kinfold, run_kinfold_async
+
+from .fakesim import random_sequence, kinfold_trajectory
+
+BENCHDIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_KINFOLD = f'{sys.executable} {os.path.join(BENCHDIR, "fake_kinfold.py")}'
+FAKE_KINEFOLD = f'{sys.executable} {os.path.join(BENCHDIR, "fake_kinefold.py")}'
+
+K0, T_EXT, T_END, T_LIN, T_LOG = 1e5, 0.02, 30, 10, 30
+
+
+class KinfoldCalls:
+    """Parsing and counting the output of (fake) Kinfold calls in memory."""
+    params = ([100, 200], [10, 50])
+    param_names = ['seqlen', 'num']
+    timeout = 300
+
+    def setup(self, seqlen, num):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        seq = random_sequence(seqlen)
+        times = get_drf_output_times(seqlen, T_EXT, T_END, T_LIN, T_LOG)
+        atupernuc = K0 * T_EXT
+        totkftime = atupernuc * seqlen + K0 * T_END
+        self.jobs = [(times, os.path.join(self.tmpdir.name, f'bench.{x:03d}'), seq, num,
+                      atupernuc, K0, totkftime, 37, None, None, None, FAKE_KINFOLD)
+                     for x in range(4)]
+
+    def teardown(self, seqlen, num):
+        self.tmpdir.cleanup()
+
+    def time_run_kinfold(self, seqlen, num):
+        for job in self.jobs:
+            run_kinfold(*job)
+
+    def time_run_kinfold_async(self, seqlen, num):
+        run_kinfold_async(self.jobs)
+
+
+class CombineTrajectories:
+    """Combining stored trajectories of different formats into one *.drf file."""
+    params = (['.drf', '.drb', '.dre', '.drf.gz'], [False, True])
+    param_names = ['suffix', 'stream']
+    timeout = 300
+
+    def setup(self, suffix, stream):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.seqlen = 200
+        seq = random_sequence(self.seqlen)
+        self.times = get_drf_output_times(self.seqlen, T_EXT, T_END, T_LIN, T_LOG)
+        ktimes = [t * K0 for t in self.times]
+        rnd = random.Random(0)
+        for x in range(8):
+            writer = open_trajectory_writer(os.path.join(self.tmpdir.name,
+                                                         f'bench.{x:03d}{suffix}'), self.times)
+            for _ in range(25):
+                # Write the structure present at each output time.
+                lines = [l.split() for l in kinfold_trajectory(seq, ktimes[-1], K0 * T_EXT,
+                                                               rnd, nstruct = 20)]
+                i = 0
+                for t, kt in enumerate(ktimes):
+                    while i < len(lines) - 1 and float(lines[i + 1][2]) <= kt:
+                        i += 1
+                    writer.write(t, lines[i][0], float(lines[i][1]))
+            writer.close()
+        self.pattern = os.path.join(self.tmpdir.name, f'bench.*{suffix}')
+        self.oname = os.path.join(self.tmpdir.name, 'out.drf')
+
+    def teardown(self, suffix, stream):
+        self.tmpdir.cleanup()
+
+    def time_combine_drfs(self, suffix, stream):
+        combine_drfs(self.pattern, self.oname, self.times, stream = stream)
+
+
+class EndToEnd:
+    """Complete DrKinfold and DrKinefold runs with fake simulators."""
+    params = [100, 200]
+    param_names = ['seqlen']
+    timeout = 600
+
+    def setup(self, seqlen):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fasta = f'>bench\n{random_sequence(seqlen)}\n'
+
+    def teardown(self, seqlen):
+        self.tmpdir.cleanup()
+
+    def _run(self, cmd):
+        subprocess.run(cmd, input = self.fasta, text = True, check = True,
+                       cwd = self.tmpdir.name, stdout = subprocess.DEVNULL)
+
+    def time_drkinfold(self, seqlen):
+        self._run(['DrKinfold', '--kinfold-exe', FAKE_KINFOLD, '-p', '4', '--no-checkpoint'])
+
+    def time_drkinefold(self, seqlen):
+        self._run(['DrKinefold', '--kinefold-exe', FAKE_KINEFOLD, '-p', '4', '--no-checkpoint'])
@@ -0,0 +1,41 @@
+#
+# Startup time of the command line scripts (run with asv).
+#
+import sys
+import subprocess
+
+SCRIPTS = ['drconverters.drkinfold', 'drconverters.drkinefold']
+
+
+def import_time(module):
+    """Cumulative import time of module in microseconds (python -X importtime)."""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          capture_output = True, text = True, check = True)
+    for line in proc.stderr.splitlines():
+        _, cumulative, name = line.split('|')
+        if name.strip() == module:
+            return int(cumulative)
+    raise ValueError(f'No import time reported for {module}.')
+
+
+class Startup:
+    """Import time and --help of DrKinfold and DrKinefold."""
+    params = SCRIPTS
+    param_names = ['module']
+
+    def track_import_time(self, module):
+        return import_time(module)
+    track_import_time.unit = 'us'
+
+    def track_deferred_imports(self, module):
+        # Heavy modules that are imported only by the code paths using them.
+        proc = subprocess.run([sys.executable, '-c', f'import sys, {module}; '
+                               'print(sum(m in sys.modules for m in ("numpy", "asyncio", '
+                               '"multiprocessing", "concurrent.futures", "zstandard")))'],
+                              capture_output = True, text = True, check = True)
+        return int(proc.stdout)
+    track_deferred_imports.unit = 'modules'
+
+    def time_help(self, module):
+        subprocess.run([sys.executable, '-m', module, '--help'], 
+                       stdout = subprocess.DEVNULL, check = True)
@@ -0,0 +1,46 @@
+#
+# Benchmarks for drconverters.utils (run with asv).
+#
+import io
+import random
+
+from drconverters.utils import (get_drf_output_times,
+                                get_drf_transcript_lengths,
+                                DrfSliceWriter, StructureInterner)
+
+
+class OutputTimes:
+    """Scaling of the output time grid with sequence length."""
+    params = [1000, 10000, 100000]
+    param_names = ['seqlen']
+
+    def time_get_drf_output_times(self, seqlen):
+        get_drf_output_times(seqlen, 0.02, 30, 10, 30)
+
+    def time_get_drf_transcript_lengths(self, seqlen):
+        get_drf_transcript_lengths(seqlen, 10, 30)
+
+    def peakmem_get_drf_output_times(self, seqlen):
+        get_drf_output_times(seqlen, 0.02, 30, 10, 30)
+
+
+class WriteDrf:
+    """Formatting and writing *.drf output times."""
+    params = [1000, 10000]
+    param_names = ['nstruct']
+
+    def setup(self, nstruct):
+        rnd = random.Random(0)
+        pool = [''.join(rnd.choice('.()') for _ in range(200)) for _ in range(nstruct)]
+        energies = {ss: -rnd.randint(0, 5000) for ss in pool}
+        self.slices = []
+        for t in range(100):
+            sample = rnd.sample(pool, nstruct // 5)
+            self.slices.append(({ss: rnd.randint(1, 20) for ss in sample},
+                                {ss: energies[ss] for ss in sample}))
+
+    def time_write_drf_slices(self, nstruct):
+        writer = DrfSliceWriter(StructureInterner(), 20 * nstruct)
+        df = io.StringIO()
+        for t, (counts, energies) in enumerate(self.slices):
+            writer.write(df, t * 0.01, counts, energies)
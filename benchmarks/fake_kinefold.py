@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+#
+# A stand-in for kinefold_long_static, used by the benchmarks:
+#
+#   DrKinefold --kinefold-exe "python benchmarks/fake_kinefold.py" ...
+#
+# Reads the Kinefold input file and writes a synthetic *.rnm file. The
+# structure diversity can be set with the environment variable FAKE_NSTRUCT.
+#
+import os
+import sys
+
+
+def main():
+    from fakesim import write_rnm
+    with open(sys.argv[1]) as kin:
+        lines = [l.split('#')[0].strip() for l in kin.read().splitlines()]
+    seed, rnmfile, datfile = int(lines[0]), lines[3], lines[7]
+    with open(datfile) as dat:
+        _, name, seq = dat.read().split()[:3]
+    t_ext = float(lines[14].split()[1]) / 1000
+    t_end = float(lines[11]) / 1000 - len(seq) * t_ext
+    nstruct = int(os.environ['FAKE_NSTRUCT']) if 'FAKE_NSTRUCT' in os.environ else None
+    write_rnm(rnmfile, name, seq, t_ext, t_end, nstruct = nstruct, seed = seed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+#
+# A stand-in for Kinfold, used by the benchmarks:
+#
+#   DrKinfold --kinfold-exe "python benchmarks/fake_kinfold.py" ...
+#
+# Reads the sequence from stdin and writes synthetic trajectories to stdout,
+# deterministic for a given --log name. The structure diversity and the
+# number of structure changes per nucleotide extension can be set with the
+# environment variables FAKE_NSTRUCT (default 100 per length) and FAKE_STEPS.
+#
+import os
+import sys
+import zlib
+import random
+
+
+def main():
+    from fakesim import kinfold_trajectory
+    args = sys.argv[1:]
+    def option(flag, default = None):
+        return args[args.index(flag) + 1] if flag in args else default
+    num = int(option('--num', 1))
+    total = float(option('--time'))
+    grow = float(option('--grow', 0))
+    glen = int(option('--glen', 1))
+    seed = zlib.crc32(option('--log', '').encode())
+    nstruct = int(os.environ.get('FAKE_NSTRUCT', 100))
+    steps = float(os.environ.get('FAKE_STEPS', 5))
+    seq = sys.stdin.readline().strip()
+    start = sys.stdin.readline().strip() if '--start' in args else None
+    rnd = random.Random(seed)
+    out = sys.stdout
+    for _ in range(num):
+        for line in kinfold_trajectory(seq, total, grow, rnd, glen, steps, nstruct, seed, start):
+            out.write(line + '\n')
+    out.flush()
+
+if __name__ == '__main__':
+    main()
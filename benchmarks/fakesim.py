@@ -0,0 +1,150 @@
+#
+# Synthetic simulation output for benchmarks.
+#
+import random
+from functools import lru_cache
+
+
+def random_helices(n, rnd, nhelix = None, pknots = True):
+    """Choose non-overlapping helices (i, j, k) on a sequence of length n.
+
+    A helix pairs nucleotides i..i+k-1 with j..j-k+1 (0-based). If pknots
+    is True, helices may cross each other.
+    """
+    nhelix = rnd.randint(0, n // 12) if nhelix is None else nhelix
+    used = [False] * n
+    helices = []
+    for _ in range(4 * nhelix):
+        if len(helices) == nhelix:
+            break
+        k = rnd.randint(3, 8)
+        if n < 2 * k + 3:
+            break
+        i = rnd.randrange(0, n - 2 * k - 3 + 1)
+        j = rnd.randrange(i + 2 * k + 2, n)
+        side = list(range(i, i + k)) + list(range(j - k + 1, j + 1))
+        if any(used[x] for x in side):
+            continue
+        if not pknots and any(a < i < c < j or i < a < j < c for a, c, _ in helices):
+            continue
+        for x in side:
+            used[x] = True
+        helices.append((i, j, k))
+    return sorted(helices)
+
+def kinefold_lines(seq, helices):
+    """Format a structure as the two lines of a Kinefold *.rnm snapshot.
+
+    For example:
+
+     A U[C G G G]C U C U[C C C G]G
+     - - -1- - - - - - - -1' - - -
+    """
+    n = len(seq)
+    side = [None] * n # (label, is_closing) for the first nucleotide of a helix side
+    inside = [False] * (n + 1)
+    for h, (i, j, k) in enumerate(helices, 1):
+        side[i] = (str(h), False)
+        side[j - k + 1] = (str(h), True)
+        for x in list(range(i, i + k)) + list(range(j - k + 1, j + 1)):
+            inside[x] = True
+    line1, line2 = [], []
+    for p in range(n + 1):
+        if side[p] if p < n else False:
+            sep = '^' if p > 0 and inside[p - 1] else '['
+        elif p > 0 and inside[p - 1] and not inside[p]:
+            sep = ']'
+        else:
+            sep = ' '
+        line1.append(sep)
+        line2.append(' ')
+        if p < n:
+            line1.append(seq[p])
+            line2.append('-')
+    for p in range(n):
+        if side[p]:
+            label = side[p][0] + ("'" if side[p][1] else '')
+            line2[2 * p + 2: 2 * p + 2 + len(label)] = label
+    return ''.join(line1).rstrip(), ''.join(line2[:len(line1)]).rstrip()
+
+def write_rnm(rnmfile, name, seq, t_ext = 0.02, t_end = 30, post = 20,
+              nstruct = None, seed = 0, n0 = 5):
+    """Write a synthetic Kinefold *.rnm file of a cotranscriptional simulation.
+
+    There is one snapshot per nucleotide extension and post additional
+    snapshots after transcription. Structures are drawn from a pool of
+    nstruct random structures per transcript length (all different if None),
+    which controls the structure diversity.
+    """
+    rnd = random.Random(seed)
+    pools = dict()
+    with open(rnmfile, 'w') as rnm:
+        rnm.write(f'< {name}\n{seq}\n')
+        ms = 0
+        for s in range(len(seq) - n0 + 1 + post):
+            n = min(len(seq), n0 + s)
+            if s <= len(seq) - n0:
+                ms = (n - n0 + rnd.random()) * t_ext * 1e3
+            else:
+                ms += rnd.random() * t_end * 1e3 / (post + 1)
+            if nstruct is None:
+                helices = random_helices(n, rnd)
+            else:
+                pool = pools.setdefault(n, [random_helices(n, random.Random(seed * 7919 + n * 31 + x))
+                                            for x in range(nstruct)])
+                helices = rnd.choice(pool)
+            en = -sum(k for _, _, k in helices) * 1.3 - rnd.random()
+            line1, line2 = kinefold_lines(seq[:n], helices)
+            rnm.write(f'{line1}| {en:.2f} kcal/mol  reached at {ms:.3f} ms, for {n} nts\n')
+            rnm.write(f'{line2}H {len(helices)} helices\n')
+
+def random_sequence(n, seed = 0):
+    rnd = random.Random(seed)
+    return ''.join(rnd.choice('ACGU') for _ in range(n))
+
+def dot_bracket(n, helices):
+    """Return the dot-bracket string of non-crossing helices (i, j, k)."""
+    db = ['.'] * n
+    for i, j, k in helices:
+        for x in range(k):
+            db[i + x], db[j - x] = '(', ')'
+    return ''.join(db)
+
+@lru_cache(maxsize = None)
+def structure_pool(n, nstruct, seed = 0):
+    """Return nstruct random pseudoknot-free helix lists for length n."""
+    return [random_helices(n, random.Random(seed * 7919 + n * 31 + x), pknots = False)
+            for x in range(nstruct)]
+
+def kinfold_trajectory(seq, total, grow, rnd, glen = 1, steps = 5, nstruct = None, seed = 0,
+                       start = None):
+    """Yield the output lines of one synthetic Kinfold --grow trajectory.
+
+    Every line holds structure, energy and time (in Kinfold's time units),
+    the last line (at time total) has an additional column. On average
+    there are steps structure changes per nucleotide extension and per
+    e-fold of time after transcription. Structures are drawn from a pool of
+    nstruct random structures per transcript length (all different if None).
+    The first structure is start, if given.
+    """
+    tx = (len(seq) - glen) * grow # End of transcription
+    t = 0
+    while True:
+        t += rnd.expovariate(steps / grow) if t < tx else rnd.expovariate(steps / max(t, 1))
+        end = t >= total
+        t = min(t, total)
+        n = min(len(seq), glen + int(t // grow)) if grow else len(seq)
+        if start is not None:
+            yield f'{start} {-1.0:6.2f} {t:10.3f}' + (' X1' if end else '')
+            start = None
+            if end:
+                break
+            continue
+        if nstruct is None:
+            helices = random_helices(n, rnd, pknots = False)
+        else:
+            helices = rnd.choice(structure_pool(n, nstruct, seed))
+        en = -sum(k for _, _, k in helices) * 1.3 - rnd.random()
+        yield f'{dot_bracket(n, helices)} {en:6.2f} {t:10.3f}' + (' X1' if end else '')
+        if end:
+            break
@@ -5,24 +5,112 @@
 #
 import os
 import sys
-import math
+import json
+import time
+import re
+import shlex
+import shutil
 import string
 import argparse
-import numpy as np
 import subprocess as sub
 from random import randint
-from packaging import version
 from glob import glob
+from functools import lru_cache
 
-import RNA
 from . import __version__
-from .utils import (parse_vienna_stdin, 
+from .metrics import Metrics
+from .utils import (parse_vienna_stdin,
+                   parse_vienna_multifasta,
+                   next_file_id,
+                   select_drf_times,
                    get_drf_output_times, 
-                   combine_drfs)
+                   open_trajectory_writer,
+                   TimeFilter,
+                   TrajectoryCounter,
+                   get_drf_transcript_lengths,
+                   combine_drfs,
+                   EnsembleWaves)
 
-_MIN_VRNA_VERSION = "2.5.1"
-if version.parse(RNA.__version__) < version.parse(_MIN_VRNA_VERSION):
-    raise ImportError(f'ViennaRNA v{_MIN_VRNA_VERSION} required (found ViennaRNA v{RNA.__version__})!')
+
+_HELIX_LABEL = re.compile(r"[^ '\-]+")
+_HELIX_BOUNDARY = re.compile(r"[\[\]^]")
+_NUCLEOTIDES = str.maketrans('', '', 'ACGU')
+_SEPARATORS = str.maketrans('', '', ' []^')
+_PK_BRACKETS = ['()', '[]', '{}', '<>'] + [u + l for u, l in 
+                                           zip(string.ascii_uppercase, string.ascii_lowercase)]
+
+def helices_to_db(n, helices):
+    """Pseudoknotted dot-bracket string from a list of helices.
+
+    Every helix (i, j, k) pairs nucleotides i..i+k-1 with j..j-k+1, a
+    single base-pair is a helix with k = 1. Helices are assigned the first
+    bracket type in (), [], {}, <>, Aa, Bb, ... that does not cross a
+    previous helix of the same type. The result is the same as normalizing
+    the structure with RNA.db_from_ptable.
+
+    Args:
+      n (int): Length of the structure.
+      helices (list): Non-overlapping helices (i, j, k), with 0 <= i < j < n.
+
+    Returns:
+      str: The dot-bracket string.
+    """
+    db = ['.'] * n
+    stacks = [] # closing positions of open helices for each bracket type.
+    for i, j, k in sorted(helices):
+        for level, stack in enumerate(stacks):
+            while stack and stack[-1] < i:
+                stack.pop()
+            if not stack or stack[-1] > j:
+                break
+        else:
+            level, stack = len(stacks), []
+            stacks.append(stack)
+        stack.append(j)
+        db[i:i+k] = _PK_BRACKETS[level][0] * k
+        db[j-k+1:j+1] = _PK_BRACKETS[level][1] * k
+    return ''.join(db)
+
+def _kinefold_sides(line1, line2):
+    """Yield (first nucleotide, length, label) of every helix side.
+
+    This assumes strictly alternating separators and nucleotides in line1,
+    only the separators [, ] and ^ are visited.
+    """
+    seps = line1[0::2]
+    start = None
+    for m in _HELIX_BOUNDARY.finditer(seps):
+        k = m.start()
+        if start is not None:
+            yield start, k - start, _kinefold_label(line2, 2 * start, 2 * k)
+        start = None if m.group() == ']' else k
+    if start is not None:
+        nnuc = len(line1) // 2
+        yield start, nnuc - start, _kinefold_label(line2, 2 * start, 2 * nnuc)
+
+def _kinefold_sides_general(line1, line2):
+    """Yield (first nucleotide, length, label) of every helix side.
+
+    Character by character version of :func:`_kinefold_sides`.
+    """
+    nnuc, start, label = 0, None, None
+    for j, x in enumerate(line1):
+        if x in 'ACGU':
+            nnuc += 1
+            continue
+        if start is not None and x in '[]^':
+            yield start, nnuc - start, label
+            start = None
+        if x == '[' or x == '^':
+            start, label = nnuc, None
+        if start is not None and label is None and j < len(line2) and line2[j] not in " -'":
+            label = _HELIX_LABEL.match(line2, j).group()
+    if start is not None:
+        yield start, nnuc - start, label
+
+def _kinefold_label(line2, start, end):
+    m = _HELIX_LABEL.search(line2, start)
+    return m.group() if m and m.start() < end else None
 
 def parse_kinefold_structure(line1, line2):
     """ For example:
@@ -31,58 +119,63 @@ def parse_kinefold_structure(line1, line2):
      - - -5- - - - - - - - - -6- - - - - - -5' - - - - -6' - - - - - - - -
      =>
      . . ( ( ( ( ( ( . . . . [ [ [ [ . . . ) ) ) ) ) ) ] ] ] ] . . . . . .
+
+    The nucleotides of a helix side are enclosed by [ ] (or separated from
+    an adjacent helix side by ^), the helix label is written in line2 after
+    the first nucleotide. The first occurrence of a label is paired with the
+    second one.
+
+    Returns:
+      str, str: the sequence and the (normalized) dot-bracket structure.
     """
-    hdict = {}
-    havail = [True for _ in range(26+1)]
-    sseq, sstr = '', ''
-    lx, lc, c = '', '', '.'
-    for j, (x, y) in enumerate(zip(line1, line2)):
-        if x == y:
-            assert x == ' '
+    sseq = line1[1::2]
+    if sseq.translate(_NUCLEOTIDES) or line1[0::2].translate(_SEPARATORS):
+        sseq = line1.translate(_SEPARATORS)
+        sides = _kinefold_sides_general(line1, line2)
+    else:
+        sides = _kinefold_sides(line1, line2)
+    first, helices = dict(), []
+    for start, length, label in sides:
+        if label not in first:
+            first[label] = (start, length)
             continue
-        if x in ('ACGU'):
-            # Append the previous x, c to strings.
-            sseq += lx
-            sstr += lc
-            lx = x
-            lc = c
-        elif x == '[' or x == '^':
-            # We need to resolve the structure character
-            c = '|'
-        elif x == ']':
-            # An unpaired strech will follow
-            c = '.'
-        if c == '|' and y not in (' ', '-', "'"):
-            # y = the full ID of the current helix.
-            jj = j
-            while line2[jj+1] not in (' ', '-', "'"):
-                y += line2[jj+1] 
-                jj += 1
-    
-            if y not in hdict:
-                myid = havail.index(True) # First occurrence of True in ID list
-                hdict[y] = [myid, j, None]
-                hid = hdict[y][0]
-                c = '(' if hid == 0 else string.ascii_letters[hid - 1 + 26]
-                havail[hid] = False
-            else:
-                hdict[y][2] = j
-                hid = hdict[y][0]
-                c = ')' if hid == 0 else string.ascii_letters[hid - 1 ]
-                havail[hid] = True
-            lc = c
-    sseq += lx
-    sstr += lc
-    return sseq, sstr
+        i, k = first.pop(label)
+        if label is None or k != length:
+            raise ValueError(f'Unbalanced Kinefold helix {label}: {line1} {line2}')
+        helices.append((i, start + length - 1, k))
+    if first:
+        raise ValueError(f'Unbalanced Kinefold helix {list(first)}: {line1} {line2}')
+    return sseq, helices_to_db(len(sseq), helices)
+
+@lru_cache(maxsize = 2**16)
+def normalize_kinefold_structure(line1, line2):
+    """Memoized :func:`parse_kinefold_structure`, keyed on the raw Kinefold lines.
 
+    The same snapshots repeat many times within and across trajectories.
+    Hit-rate statistics are available via cache_info().
 
-def rnm_to_drf(rnmfile, drffile, times, t_ext):
+    Returns:
+      str, str: the sequence and the normalized dot-bracket structure.
+    """
+    return parse_kinefold_structure(line1, line2)
+
+def rnm_to_drf(rnmfile, drffile, times, t_ext, t_lin, counter = None, select = None):
     """Translates Kinefold *.rnm file to DrForna *.drf file.
+
+    If a :class:`TrajectoryCounter` is given, the trajectory is also added
+    to its counts. If select is given, only these time indices are written
+    (and counted).
     """ 
-    idc = 0
-    with open(rnmfile, 'r') as rnm, open(drffile, 'w') as drf, open(rnmfile + '.log', 'w') as log:
-        drf.write(f"id time occupancy structure energy\n")
-        t, delay = 0, None
+    times = list(times)
+    rnm = open(rnmfile, 'r')
+    writer = open_trajectory_writer(drffile, 
+                                    times if select is None else [times[i] for i in select])
+    if counter is not None:
+        counter.writer, writer = writer, counter
+    if select is not None:
+        writer = TimeFilter(writer, select)
+    with rnm, writer as drf, open(rnmfile + '.log', 'w') as log:
+        t, delay, idc = 0, None, 0
         lsstr = '.'
         for i, line in enumerate(rnm, 1):
             line = line.rstrip()
@@ -92,6 +185,8 @@ def rnm_to_drf(rnmfile, drffile, times, t_ext):
                 continue
             if i == 2:
                 seq = line
+                t_log = len(times) - len(seq) * t_lin - 1
+                tlens = get_drf_transcript_lengths(len(seq), t_lin, t_log).tolist()
                 continue
             if i % 2: # process sequence info
                 subseq = line
@@ -101,20 +196,14 @@ def rnm_to_drf(rnmfile, drffile, times, t_ext):
                 en, eunit, _, _, ms, tunit = info.split()[0:6]
                 assert eunit == 'kcal/mol'
                 assert tunit == 'ms,'
-                sseq, sstr = parse_kinefold_structure(subseq.rstrip(), substr.rstrip())
-                sstr = RNA.db_from_ptable(RNA.ptable(sstr, RNA.BRACKETS_ANY))
+                sseq, sstr = normalize_kinefold_structure(subseq.rstrip(), substr.rstrip())
                 stime = float(ms) * 10**(-3)
                 if delay is None:
                     delay = len(sstr) * t_ext
                 stime += delay
                 log.write(f'# {float(ms) * 10**(-3):13.9f} {stime:13.9f} {sstr} {float(en):6.2f}\n')
                 while t < len(times) and times[t] <= stime:
-                    tlen = round(times[t]/t_ext) if np.isclose(round(times[t]/t_ext, 9), 
-                                                               times[t]/t_ext) else math.ceil(times[t]/t_ext)
-                    if tlen == 0:
-                        tlen = 1
-                    elif tlen > len(seq):
-                        tlen = len(seq)
+                    tlen = tlens[t]
                     if len(lsstr) < tlen:
                         lsstr += '.' * (tlen-len(lsstr))
                     elif len(lsstr) > tlen:
@@ -123,12 +212,12 @@ def rnm_to_drf(rnmfile, drffile, times, t_ext):
                         raise ValueError('This case has never been observed before!')
                         lsstr = lsstr[:tlen]
                     assert len(lsstr) == tlen
-                    drf.write(f'{idc:>5d} {times[t]:13.9f} 1 {lsstr} {float(en):6.2f}\n')
+                    drf.write(t, lsstr, float(en), idc)
                     t += 1
                 lsstr = sstr
                 idc += 1
         while t < len(times):
-            drf.write(f'{idc:>5d} {times[t]:13.9f} 1 {lsstr} {float(en):6.2f}\n')
+            drf.write(t, lsstr, float(en), idc)
             t += 1
     return seq, name
 
@@ -140,12 +229,99 @@ def parse_drkinefold_args(parser):
             help = """Name your output files, name the header of your plots, etc.
             this option overwrites the fasta-header.""")
 
+    parser.add_argument("--batch", action = "store_true",
+            help = """Read multiple sequences in fasta format. All Kinefold calls
+            share the same pool of --cpus, one *.drf file is written per
+            sequence. The fasta headers are used as names.""")
+
     parser.add_argument("--tmpdir", default = 'drkinefold', action = 'store', metavar = '<str>',
             help = """Specify path for storing Kinefold output files.""")
 
+    parser.add_argument("--kinefold-exe", default = KINEFOLD, metavar = '<str>',
+            help = """The Kinefold executable, e.g. a path or a command with
+            arguments.""")
+
     parser.add_argument("-p", "--processes", type = int, default = 0,
             help="Number of individual Kinefold system calls. By default, only existing data is processed.")
 
+    parser.add_argument("-c", "--cpus", type = int, default = None,
+            help="Maximal number of parallel Kinefold calls, also used for combining the output files.")
+
+    parser.add_argument("--binary", action = "store_true",
+            help = """Store the trajectories of individual simulations in a
+            compact binary format (*.drb) instead of text (*.drf) files.""")
+
+    parser.add_argument("--events", action = "store_true",
+            help = """Store the trajectories of individual simulations as text
+            files of structure changes (*.dre) instead of one line per output
+            time (*.drf).""")
+
+    parser.add_argument("--compress", default = None, choices = ('gz', 'xz', 'zst'),
+            help = """Compress the trajectory files of individual simulations
+            (zst requires the zstandard package). Compression runs in a
+            background thread.""")
+
+    parser.add_argument("--compress-output", action = "store_true",
+            help = """Also compress the combined output file(s) using the
+            --compress format, e.g. {name}.drf.gz.""")
+
+    parser.add_argument("--no-checkpoint", action = "store_true",
+            help = """Do not store the combined simulations in --tmpdir. By
+            default, only new simulation files are parsed when adding
+            simulations to an existing --tmpdir.""")
+
+    parser.add_argument("--stream", action = "store_true",
+            help = """Combine the simulation files one output time after the
+            other, rather than loading all simulations into memory at once.""")
+
+    parser.add_argument("--min-occupancy", type = float, default = 0, metavar = '<flt>',
+            help = """Do not write structures with lower occupancy at an output
+            time into the combined *.drf file.""")
+
+    parser.add_argument("--top-k", type = int, default = None, metavar = '<int>',
+            help = """Write at most the top-k most populated structures per
+            output time into the combined *.drf file.""")
+
+    parser.add_argument("--max-mass", type = float, default = None, metavar = '<flt>',
+            help = """Write the most populated structures per output time until
+            their cumulative occupancy reaches this value.""")
+
+    parser.add_argument("--other", action = "store_true",
+            help = """Write the occupancy of structures discarded by
+            --min-occupancy, --top-k and --max-mass as a single record with
+            ID -1 and structure "other".""")
+
+    parser.add_argument("--profile", action = "store_true",
+            help = """Report wall-clock and CPU time, throughput, I/O and memory
+            usage of the Kinefold calls, of the conversion of their output and
+            of combining the output.""")
+
+    parser.add_argument("--metrics", default = None, metavar = '<str>',
+            help = """Write the --profile metrics, including statistics of every
+            Kinefold call, to this JSON file.""")
+
+    parser.add_argument("--cprofile", default = None, metavar = '<str>',
+            help = """Profile the Python code of all stages with cProfile and
+            write the statistics to this file.""")
+
+    parser.add_argument("--tolerance", type = float, default = None, metavar = '<flt>',
+            help = """Adaptive ensemble size: Repeat waves of --processes Kinefold
+            calls until the convergence statistic (see --convergence) drops
+            below this tolerance.""")
+
+    parser.add_argument("--convergence", default = 'se', choices = ('se', 'tv'),
+            help = """Convergence statistic for --tolerance: the maximum standard
+            error of an occupancy (se), or the maximum total variation distance
+            per output time between the simulations of odd and of even waves
+            (tv, requires at least two waves).""")
+
+    parser.add_argument("--time-budget", type = float, default = None, metavar = '<flt>',
+            help = """Do not start new waves after this wall-clock time [s].""")
+
+    parser.add_argument("--cpu-budget", type = float, default = None, metavar = '<flt>',
+            help = """Do not start new waves after this CPU time, including all
+            child processes [s].""")
+
     parser.add_argument("--t-ext", type = float, default = 0.02, metavar = '<flt>',
             help = """Time per nucleotide extension (the inverse of the transcription rate)
             [s/nt].""")
@@ -158,20 +334,44 @@ def parse_drkinefold_args(parser):
 
     parser.add_argument("--t-log", type = int, default = 30, metavar = '<int>',
             help = """Evenly space output *--t-log* times after transcription on a logarithmic time scale.""")
+
+    parser.add_argument("--t-stride", type = int, default = 1, metavar = '<int>',
+            help = """Only store every n-th output time in the trajectory files
+            and the combined output. The last output time is always stored.""")
+
+    parser.add_argument("--t-window", type = float, nargs = 2, default = None, 
+            metavar = '<flt>',
+            help = """Only store output times within this time window [s].""")
+
+    parser.add_argument("--preview", type = int, default = 0, metavar = '<int>',
+            help = """Also write a preview file {name}.preview.drf with every
+            n-th output time of the combined output.""")
+
+    parser.add_argument("--kp8", action = "store_true",
+            help = """Also write the distribution of structures at the last
+            output time to {name}.drf.kp8.""")
+
+    parser.add_argument("--npz", action = "store_true",
+            help = """Also write the combined output as arrays to {name}.npz: a
+            dense (times x structures) occupancy matrix, the structure table
+            with energies, and the entropy and effective number of structures
+            at every output time. Load with numpy.load.""")
     return
 
 
-def get_kinefold_input(name, i, seq, t_ext, t_end):
+KINEFOLD = './kinefold_long_static' # The Kinefold executable, may include arguments.
+
+def get_kinefold_input(jobname, seq, t_ext, t_end):
     wdir = os.getcwd()
     return f"""\
 {randint(1, 10000)}	# random seed
-{wdir}/{name}.w
-{wdir}/{name}.w
-{wdir}/{name}.{i:03d}.rnm
-{wdir}/{name}.w
-{wdir}/{name}.w
-{wdir}/{name}.w
-{wdir}/{name}.dat
+{wdir}/{jobname}.w
+{wdir}/{jobname}.w
+{wdir}/{jobname}.rnm
+{wdir}/{jobname}.w
+{wdir}/{jobname}.w
+{wdir}/{jobname}.w
+{wdir}/{jobname}.dat
 0		# 0=RNA ; 1=DNA
 6.3460741	# helix minimum free energy in kcal/mol: 6.3460741=10kT
 10000000	# NA
@@ -182,6 +382,66 @@ def get_kinefold_input(name, i, seq, t_ext, t_end):
 		# add T i j k or F i j k options here 
 """
 
+def convert_rnm(rnmfile, suffix, times, t_ext, t_lin, counter = None, select = None):
+    """Convert a *.rnm file into a trajectory file with the given suffix.
+    """
+    drffile = rnmfile[:-4] + suffix
+    keep = [drffile, drffile[:-1] + 's'] if suffix == '.drb' else [drffile]
+    for oldfile in glob(rnmfile[:-4] + '.dr[fbes]*'):
+        if oldfile not in keep: # Do not count the same trajectory twice.
+            os.remove(oldfile)
+    return rnm_to_drf(rnmfile, drffile, times, t_ext, t_lin, counter, select)
+
+def load_conversion_manifest(manifest, key):
+    """Return the recorded size and mtime of converted *.rnm files.
+
+    The manifest is only valid if the conversion parameters (key) match.
+    """
+    if not os.path.exists(manifest):
+        return dict()
+    with open(manifest) as mf:
+        data = json.load(mf)
+    if data['key'] != json.loads(json.dumps(key)):
+        return dict()
+    return data['files']
+
+def save_conversion_manifest(manifest, key, files):
+    with open(manifest, 'w') as mf:
+        json.dump({'key': key, 'files': files}, mf)
+
+def run_kinefold(jobname, name, seq, t_ext, t_end, executable = None):
+    """Run a single Kinefold simulation.
+
+    Every job uses its own scratch files ({jobname}.w, {jobname}.i and
+    {jobname}.dat), such that multiple jobs can run in the same directory.
+    The executable defaults to :data:`KINEFOLD`.
+
+    Returns:
+      str: The *.rnm output file.
+
+    Raises:
+      ChildProcessError: If Kinefold fails or writes no *.rnm file. An
+        incomplete *.rnm file is removed.
+    """
+    print(f'[in progress:] Calling Kinefold for {jobname}.')
+    with open(f'{jobname}.dat', 'w') as dat:
+        dat.write(f'< {name}\n')
+        dat.write(f'{seq}\n')
+    infile = f'{jobname}.in'
+    with open(infile, 'w') as k:
+        k.write(get_kinefold_input(jobname, seq, t_ext, t_end))
+    kcall = shlex.split(executable or KINEFOLD) + [infile, '-noprint']
+    proc = sub.run(kcall, capture_output = True) 
+    for scratch in (f'{jobname}.w', f'{jobname}.i', f'{jobname}.dat'):
+        if os.path.exists(scratch):
+            os.remove(scratch)
+    rnmfile = f'{jobname}.rnm'
+    if proc.returncode or not os.path.exists(rnmfile):
+        if os.path.exists(rnmfile):
+            os.remove(rnmfile)
+        raise ChildProcessError(f'Kinefold call for {jobname} failed (exit status {proc.returncode}).')
+    print(f'[Done:] Kinefold call for {jobname} finished.')
+    return rnmfile
 
 def main():
     """Translate Kinefold cotranscriptional folding output to DrForna input format.
@@ -191,76 +451,159 @@ def main():
         description = 'DrKinefold: Produce DrForna input from Kinefold simulation output.')
     parse_drkinefold_args(parser)
     args = parser.parse_args()
+    metrics = Metrics(args.profile or args.metrics is not None, args.cprofile)
 
-    if args.processes and not os.path.exists('kinefold_long_static'):
-        raise SystemExit(f'Kinfold executable "kinefold_long_static" not found.')
+    kexe = shlex.split(args.kinefold_exe)[0]
+    if args.processes and not (os.path.exists(kexe) or shutil.which(kexe)):
+        raise SystemExit(f'Kinefold executable "{kexe}" not found.')
 
 
     #
     # Read Input & Update Arguments
     #
-    name, seq = parse_vienna_stdin(sys.stdin)
-    if args.name:
-        name = args.name
-    print(f'>{name}\n{seq}')
+    if args.batch:
+        sequences = parse_vienna_multifasta(sys.stdin)
+    else:
+        name, seq = parse_vienna_stdin(sys.stdin)
+        sequences = [(args.name if args.name else name, seq)]
+    if not os.path.exists(args.tmpdir):
+        os.mkdir(args.tmpdir)
     # NOTE: Adding ext/end, as they are necessary to adjust Kinefold simulations ...
     #name = f'{name}_ext-{args.t_ext}_end-{args.t_end}'
-    
-    #
-    # Prepare the output times in the *.drf file format.
-    #
-    times = get_drf_output_times(len(seq), args.t_ext, args.t_end, args.t_lin, args.t_log)
 
-    #
-    # Put everything in one directory, update the file ID in case there are
-    # existing simulations.
-    #
-    fid = 1 # Set initial file ID according to what can already be found in tmpdir.
-    if os.path.exists(args.tmpdir):
-        for data in glob(f'{args.tmpdir}/{name}*.rnm'):
-            ndata = data.split('/')[-1]
-            *pre, nfid, suf = ndata.split('.')
-            fid = max(fid, int(nfid)+1)
-    else:
-        os.mkdir(args.tmpdir)
-    
-    #
-    # The *.dat file seems to be required input?!?
-    #
-    if args.processes:
-        datf = os.path.join(args.tmpdir, f'{name}.dat')
-        if os.path.exists(datf):
-            print(f"WARNING: Overwriting existing file: {datf}")
-        with open(datf, 'w') as dat:
-            dat.write(f'< {name}\n')
-            dat.write(f'{seq}\n')
+    if args.tolerance is not None and (args.stream or not args.processes):
+        raise SystemExit('--tolerance requires --processes and is incompatible with --stream.')
 
-    #
-    # Do --processes separate simulations.
-    #
-    for i in range(fid, args.processes+fid):
-        print(f'[in progress:] Calling Kinefold #{i}.')
-        infile = os.path.join(args.tmpdir, f'{name}.{i:03d}.in')
-        with open(infile, 'w') as k:
-            k.write(get_kinefold_input(f'{args.tmpdir}/{name}', i, seq, args.t_ext, args.t_end))
-        kcall = ['./kinefold_long_static', infile, '-noprint']
-        sub.run(kcall, capture_output = True) 
-    if args.processes: # clean up 
-        os.remove(f'{args.tmpdir}/{name}.w')
-        os.remove(f'{args.tmpdir}/{name}.i')
+    if args.binary and args.events:
+        raise SystemExit('Choose only one of --binary and --events.')
+    suffix = '.drb' if args.binary else '.dre' if args.events else '.drf'
+    if args.compress:
+        if args.binary:
+            raise SystemExit('--compress is not supported for --binary trajectories.')
+        suffix += f'.{args.compress}'
+    oext = f'.{args.compress}' if args.compress and args.compress_output else ''
+    state = dict()
+    for name, seq in sequences:
+        print(f'>{name}\n{seq}')
+        #
+        # Prepare the output times in the *.drf file format.
+        #
+        times = get_drf_output_times(len(seq), args.t_ext, args.t_end, args.t_lin, args.t_log)
+        select = None
+        if args.t_stride > 1 or args.t_window:
+            select = select_drf_times(times, args.t_stride, args.t_window)
+        manifest = f'{args.tmpdir}/{name}.rnm.json'
+        mkey = dict(sequence = seq, t_ext = args.t_ext, t_end = args.t_end,
+                    t_lin = args.t_lin, t_log = args.t_log, suffix = suffix,
+                    t_stride = args.t_stride, t_window = args.t_window)
+        state[name] = dict(seq = seq, times = times, select = select,
+                           stimes = times if select is None else [times[i] for i in select],
+                           manifest = manifest, mkey = mkey,
+                           converted = load_conversion_manifest(manifest, mkey),
+                           collected = dict())
 
-    #
-    # Convert all rnmfiles to drffiles using the current time vector.
-    #
-    for rnmfile in glob(f'{args.tmpdir}/{name}.*.rnm'):
-        drffile = rnmfile[:-3]+'drf'
-        kseq, kname = rnm_to_drf(rnmfile, drffile, times, args.t_ext)
-        assert kseq == seq and kname == name
+    def convert(name, rnmfile):
+        st = state[name]
+        counter = TrajectoryCounter(st['stimes'])
+        info = normalize_kinefold_structure.cache_info()
+        with metrics.stage('convert'):
+            kseq, kname = convert_rnm(rnmfile, suffix, st['times'], args.t_ext, args.t_lin, 
+                                      counter, st['select'])
+        assert kseq == st['seq'] and kname == name
+        st['collected'][rnmfile[:-4] + suffix] = counter.result()
+        fs = os.stat(rnmfile)
+        st['converted'][os.path.basename(rnmfile)] = [fs.st_size, fs.st_mtime_ns]
+        ninfo = normalize_kinefold_structure.cache_info()
+        metrics.count('convert', 'structures', ninfo.hits + ninfo.misses - info.hits - info.misses)
+        metrics.count('convert', 'simulations', counter.nsim)
+        metrics.count('convert', 'bytes_parsed', fs.st_size)
+
+    def simulate(*job):
+        wall = time.perf_counter()
+        rnmfile = run_kinefold(*job)
+        return rnmfile, dict(name = job[0], wall = time.perf_counter() - wall)
 
     #
-    # Combine all drf files from individual simulations to one lage output file.
+    # Simulations are done in waves of --processes Kinefold calls per
+    # sequence. Without --tolerance, there is only one wave. Otherwise, new
+    # waves are started until the ensemble of every sequence has converged or
+    # the budget is exhausted.
     #
-    combine_drfs(f'{args.tmpdir}/{name}*.drf', f'{name}.drf', len(seq), times, use_counts = False)
+    waves = EnsembleWaves(state, args.tolerance, args.convergence, 
+                          args.time_budget, args.cpu_budget)
+    for pending in waves:
+        #
+        # Put everything in one directory, update the file ID in case there are
+        # existing simulations.
+        #
+        jobs = []
+        for name in pending:
+            fid = next_file_id(f'{args.tmpdir}/{name}.*.rnm')
+            jobs.extend((f'{args.tmpdir}/{name}.{i:03d}', name, state[name]['seq'], 
+                         args.t_ext, args.t_end, args.kinefold_exe) 
+                        for i in range(fid, args.processes+fid))
+
+        #
+        # Do --processes separate simulations per sequence, all sequences share
+        # the same pool of workers and long sequences are started first. Every
+        # finished simulation is converted and counted right away, while the
+        # others are still running. Existing *.rnm files are only converted if
+        # they are new or changed.
+        #
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        jobs.sort(key = lambda job: len(job[2]), reverse = True)
+        workers = args.cpus or os.cpu_count()
+        with metrics.stage('kinefold', workers = min(len(jobs), workers)), \
+                ThreadPoolExecutor(max_workers = workers) as pool:
+            futures = {pool.submit(simulate, *job): job[1] for job in jobs}
+            for job in as_completed(futures):
+                try:
+                    rnmfile, stats = job.result()
+                except ChildProcessError as err:
+                    print(f'[WARNING:] {err} Skipping this simulation.')
+                    continue
+                metrics.subprocess('kinefold', stats)
+                convert(futures[job], rnmfile)
+
+        for name in pending:
+            st = state[name]
+            for rnmfile in sorted(glob(f'{args.tmpdir}/{name}.*.rnm')):
+                fs = os.stat(rnmfile)
+                if st['converted'].get(os.path.basename(rnmfile)) == [fs.st_size, fs.st_mtime_ns] \
+                        and os.path.exists(rnmfile[:-4] + suffix):
+                    continue
+                convert(name, rnmfile)
+            save_conversion_manifest(st['manifest'], st['mkey'], st['converted'])
+        info = normalize_kinefold_structure.cache_info()
+        if info.hits + info.misses:
+            print(f'[structure cache:] {info.hits} hits, {info.misses} misses '
+                  f'({info.hits/(info.hits+info.misses):.1%}), {info.currsize} cached snapshots.')
+
+        #
+        # Combine all drf files from individual simulations to one lage output
+        # file per sequence.
+        #
+        for name in pending:
+            st = state[name]
+            seq = st['seq']
+            previews = None
+            if args.preview:
+                previews = {f'{name}.preview.drf{oext}': select_drf_times(st['stimes'], args.preview)}
+            with metrics.stage('combine'):
+                aggregate = combine_drfs(f'{args.tmpdir}/{name}.*.dr[fbe]*', f'{name}.drf{oext}',
+                            st['stimes'], use_counts = False, stream = args.stream, cpus = args.cpus,
+                            collected = st['collected'],
+                            min_occupancy = args.min_occupancy, top_k = args.top_k,
+                            max_mass = args.max_mass, other = args.other, previews = previews,
+                            get_kp8 = args.kp8, arrays = f'{name}.npz' if args.npz else None,
+                            checkpoint = None if args.no_checkpoint else f'{args.tmpdir}/{name}.agg.npz',
+                            checkpoint_key = dict(sequence = seq, t_ext = args.t_ext, t_end = args.t_end,
+                                                  t_lin = args.t_lin, t_log = args.t_log,
+                                                  t_stride = args.t_stride, t_window = args.t_window))
+            metrics.count('combine', 'simulations', aggregate[2] if aggregate else 0)
+            if aggregate:
+                waves.update(name, aggregate[0], aggregate[2])
+    metrics.close(args.metrics)
     return
 
 if __name__ == '__main__':
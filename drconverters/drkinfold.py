@@ -5,18 +5,32 @@
 #
 import os
 import sys
-import glob
+import math
+import time
+import shlex
 import argparse
-import numpy as np
+from collections import Counter
 from subprocess import Popen, PIPE
-from multiprocessing import Pool
 
 from . import __version__
+from .metrics import Metrics
 from .utils import (parse_vienna_stdin, 
+                    parse_vienna_multifasta,
+                    next_file_id,
+                    select_drf_times,
                     get_drf_output_times, 
-                    combine_drfs)
+                    open_trajectory_writer,
+                    TimeFilter,
+                    TrajectoryCounter,
+                    combine_drfs,
+                    check_drf_checkpoint,
+                    cpu_times,
+                    EnsembleWaves)
 
 
+KINFOLD = 'Kinfold' # The Kinfold executable, may include arguments.
+PREFIX = '_prefix' # Name of the Kinfold calls for the shared prefix (--warm-start).
+
 def syscall_kinfold(name, seq,
                     start = None,
                     stop = None,
@@ -37,7 +51,8 @@ def syscall_kinfold(name, seq,
                     erange = 20, # Kinfold Default.
                     lmin = False,
                     silent = False,
-                    force = False):
+                    force = False,
+                    executable = None):
     """Perform a system-call of the program ``Kinfold``.
 
     The print the results into a file and return the respective filename. This
@@ -54,7 +69,7 @@ def syscall_kinfold(name, seq,
         os.remove(klfile)
 
     kinput = seq + '\n'
-    syscall = ['Kinfold']
+    syscall = shlex.split(executable or KINFOLD)
     syscall.extend(['--num', str(int(num))])
     syscall.extend(['--time', str(time)])
     syscall.extend(['--log', name])
@@ -126,37 +141,199 @@ def sub_kinfold(*kargs, **kwargs):
                    bufsize = 1, 
                    universal_newlines = True, 
                    stderr = ehandle) as proc:
-            proc.stdin.write(kinput)
-            proc.stdin.close()
-            for line in proc.stdout:
-                yield line
+            try:
+                proc.stdin.write(kinput)
+                proc.stdin.close()
+                for line in proc.stdout:
+                    yield line
+            except BaseException:
+                proc.kill()
+                raise
+    if proc.returncode:
+        raise ChildProcessError(f'Kinfold call for {name} failed, see {kefile}.')
     return
 
-def run_kinfold(times, basename, seq, num, atupernuc, atupersec, totkftime, temperature, params):
-    idc = 0
-    with open(f'{basename}.drf', 'w') as drf:
-        drf.write(f"id time occupancy structure energy\n")
-        t, nsim = 0, 0
-        for line in sub_kinfold(basename, seq, num = num, glen = 1, temp = temperature,
-                                params = params, grow = atupernuc, time = totkftime, 
-                                erange = 999999):
-            [ss, en, st] = line.split()[0:3]
-            stime = float(st)
-            # Add all drf output times until the give time step
-            while t < len(times) and times[t]*atupersec <= stime:
-                drf.write(f'{idc:>5d} {times[t]:13.9f} 1 {ss} {float(en):6.2f}\n')
+class KinfoldOutput:
+    """Map the output lines of a Kinfold call onto the output times.
+
+    Every line of Kinfold output (structure, energy, time) is written to
+    writer at all output times up to the time of the line. Kinfold marks the
+    last line of a simulation with a fourth column, the structures of these
+    lines are collected in final.
+
+    Args:
+      times (list): The output times of every simulation.
+      atupersec (float): Kinfold's internal time units per second.
+      writer (DrfWriter): Receives the structures at every output time.
+      basename (str): Name of the Kinfold call for messages.
+    """
+    def __init__(self, times, atupersec, writer, basename):
+        self.ktimes = [x * atupersec for x in times] # in Kinfold's internal time units
+        self.writer = writer
+        self.basename = basename
+        self.t, self.nsim, self.idc = 0, 0, 0
+        self.final = []
+
+    def feed(self, line):
+        """Process one line of Kinfold output."""
+        ktimes, drf, t = self.ktimes, self.writer, self.t
+        [ss, en, st] = line.split()[0:3]
+        stime, en = float(st), float(en)
+        # Add all drf output times until the give time step
+        while t < len(ktimes) and ktimes[t] <= stime:
+            drf.write(t, ss, en, self.idc)
+            t += 1
+        if len(line.split()) == 4:
+            if t < len(ktimes):
+                if t != len(ktimes) - 1 or not math.isclose(ktimes[t], stime, rel_tol = 1e-5):
+                    raise ValueError(f'Kinfold simulation in {self.basename} ended at time {stime}, '
+                                     f'expected {ktimes[-1]}.')
+                drf.write(t, ss, en, self.idc)
                 t += 1
-            if len(line.split()) == 4:
-                if t < len(times):
-                    assert np.isclose(times[t]*atupersec, stime)
-                    drf.write(f'{idc:>5d} {times[t]:13.9f} 1 {ss} {float(en):6.2f}\n')
-                    t += 1
-                assert t == len(times)
-                t = 0
-                nsim += 1
-                print(f'[status update:] Done with simulation {nsim} in {basename}.drf. ', end = '\r')
-            idc += 1
-    print(f'[Done:] Kinfold call for {basename} finished after {nsim} simulations. ')
+            t = 0
+            self.nsim += 1
+            self.final.append(ss)
+            print(f'[status update:] Done with simulation {self.nsim} in {self.basename}. ', end = '\r')
+        self.idc += 1
+        self.t = t
+
+def _kinfold_counter(times, basename, suffix, select):
+    """Return a TrajectoryCounter and the writer that Kinfold output is fed into.
+
+    The counter forwards all structures to the trajectory file
+    {basename}{suffix}, unless suffix is None.
+    """
+    stimes = times if select is None else [times[i] for i in select]
+    counter = TrajectoryCounter(stimes, None if suffix is None else
+                                open_trajectory_writer(f'{basename}{suffix}', stimes))
+    # Only count (and store) the selected output times.
+    return counter, (counter if select is None else TimeFilter(counter, select))
+
+def _kinfold_worker():
+    """Initialize a pool worker to exit on SIGTERM, such that its Kinfold call
+    is killed when the pool is terminated."""
+    import signal
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
+def run_kinfold(times, basename, seq, num, atupernuc, atupersec, totkftime, temperature, params,
+                suffix = None, select = None, executable = None, start = None, glen = 1):
+    """Run one Kinfold call and count its trajectories in memory.
+
+    If suffix is given, the trajectories are also written to a file
+    {basename}{suffix}. The executable defaults to :data:`KINFOLD`. With
+    start, all simulations continue from the structure start of the first
+    glen nucleotides, the times are then relative to that point.
+
+    Returns:
+      tuple, dict: Counts, energies and number of simulations (see
+        :class:`TrajectoryCounter`), and statistics of the Kinfold call:
+        wall-clock time, CPU time of Kinfold and of parsing its output,
+        lines, bytes and simulations, as well as the final structure of
+        every simulation.
+
+    Raises:
+      ChildProcessError: If Kinfold exits with a non-zero status.
+    """
+    wall, (cpu, kcpu) = time.perf_counter(), cpu_times()
+    nbytes = 0
+    counter, writer = _kinfold_counter(times, basename, suffix, select)
+    with counter:
+        kout = KinfoldOutput(times, atupersec, writer, basename)
+        for line in sub_kinfold(basename, seq, num = num, glen = glen, start = start,
+                                temp = temperature, params = params, grow = atupernuc, 
+                                time = totkftime, erange = 999999, executable = executable):
+            nbytes += len(line)
+            kout.feed(line)
+    print(f'[Done:] Kinfold call for {basename} finished after {kout.nsim} simulations. ')
+    ncpu, nkcpu = cpu_times() # Only Kinfold runs as a child of this process.
+    stats = dict(name = basename, wall = time.perf_counter() - wall, parse_cpu = ncpu - cpu,
+                 kinfold_cpu = nkcpu - kcpu, lines = kout.idc, bytes = nbytes, 
+                 simulations = kout.nsim, final = kout.final)
+    return counter.result(), stats
+
+async def _async_kinfold(semaphore, times, basename, seq, num, atupernuc, atupersec, totkftime, 
+                         temperature, params, suffix = None, select = None, 
+                         executable = None, start = None, glen = 1):
+    """Asynchronous version of :func:`run_kinfold`.
+
+    The trajectory file is only opened once the Kinfold call acquired the
+    semaphore. The Kinfold process is killed if the call is cancelled. The
+    CPU times of individual Kinfold calls are not available, as all calls
+    are children of the same process.
+    """
+    import asyncio
+    nbytes = 0
+    kinput, kcall = syscall_kinfold(basename, seq, num = num, glen = glen, start = start,
+                                    temp = temperature, params = params, grow = atupernuc, 
+                                    time = totkftime, erange = 999999, executable = executable)
+    async with semaphore:
+        wall = time.perf_counter()
+        print('[in progress:] ' + ' '.join(kcall))
+        counter, writer = _kinfold_counter(times, basename, suffix, select)
+        kout = KinfoldOutput(times, atupersec, writer, basename)
+        with open(basename + '.err', 'w') as ehandle, counter:
+            # Cancelling the process creation itself can stall the event
+            # loop, the process is killed once it has been created instead.
+            create = asyncio.ensure_future(asyncio.create_subprocess_exec(*kcall, 
+                                           stdin = PIPE, stdout = PIPE, stderr = ehandle, 
+                                           limit = 2**24))
+            try:
+                proc = await asyncio.shield(create)
+            except asyncio.CancelledError:
+                proc = await create
+                proc.kill()
+                await proc.wait()
+                raise
+            try:
+                proc.stdin.write(kinput.encode())
+                await proc.stdin.drain()
+                proc.stdin.close()
+                async for line in proc.stdout:
+                    nbytes += len(line)
+                    kout.feed(line.decode())
+                await proc.wait()
+            finally:
+                if proc.returncode is None:
+                    proc.kill()
+                    await proc.wait()
+            if proc.returncode:
+                raise ChildProcessError(f'Kinfold call for {basename} failed, see {basename}.err.')
+        wall = time.perf_counter() - wall
+    print(f'[Done:] Kinfold call for {basename} finished after {kout.nsim} simulations. ')
+    stats = dict(name = basename, wall = wall, lines = kout.idc, 
+                 bytes = nbytes, simulations = kout.nsim, final = kout.final)
+    return counter.result(), stats
+
+def run_kinfold_async(jobs, cpus = None):
+    """Run many Kinfold calls from a single event loop.
+
+    At most cpus Kinfold processes run at the same time, their output is
+    read concurrently and counted in memory, see :func:`run_kinfold`. If
+    one call fails, all other calls are cancelled and their Kinfold
+    processes are killed.
+
+    Args:
+      jobs (list): Arguments of :func:`run_kinfold`.
+      cpus (int, optional): Maximal number of Kinfold processes. Defaults to
+        the number of cpus.
+
+    Returns:
+      list: Results and statistics of every job, see :func:`run_kinfold`.
+    """
+    import asyncio
+    async def run():
+        semaphore = asyncio.Semaphore(cpus or os.cpu_count() or 1)
+        tasks = [asyncio.ensure_future(_async_kinfold(semaphore, *job)) for job in jobs]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions = True)
+    try:
+        return asyncio.run(run())
+    except ChildProcessError as err:
+        raise SystemExit(str(err))
 
 def parse_drkinfold_args(parser):
     parser.add_argument('--version', action = 'version', 
@@ -166,14 +343,30 @@ def parse_drkinfold_args(parser):
             help = """Name your output files, name the header of your plots, etc.
             this option overwrites the fasta-header.""")
 
+    parser.add_argument("--batch", action = "store_true",
+            help = """Read multiple sequences in fasta format. All Kinfold calls
+            share the same pool of --cpus, one *.drf file is written per
+            sequence. The fasta headers are used as names.""")
+
+    parser.add_argument("--warm-start", action = "store_true",
+            help = """Simulate the 5' prefix shared by all --batch sequences only
+            once and continue every sequence from the structures at the end of
+            the prefix (Kinfold --start). All sequences share the prefix
+            trajectories. Incompatible with --keep-trajectories, --stream and
+            --no-checkpoint.""")
+
     parser.add_argument("--tmpdir", default = 'drkinfold', action = 'store', metavar = '<str>',
             help = """Specify path for storing Kinfold output files.""")
 
+    parser.add_argument("--kinfold-exe", default = KINFOLD, metavar = '<str>',
+            help = """The Kinfold executable, e.g. a path or a command with
+            arguments.""")
+
     parser.add_argument("-p", "--processes", type = int, default = 0,
             help="Number of individual Kinfold system calls. By default, only existing data is processed.")
 
     parser.add_argument("-c", "--cpus", type = int, default = None,
-            help="Maximal number of cpus used for threading.")
+            help="Maximal number of cpus used for Kinfold calls and for combining the output files.")
 
     parser.add_argument("-n", "--num", type = int, default = 1,
             help="Number of simulations per Kinfold call.")
@@ -182,6 +375,78 @@ def parse_drkinfold_args(parser):
             help = """Arrhenius rate constant. Adjust to relate free energy
             changes to experimentally determined folding time [atu/s].""")
 
+    parser.add_argument("--binary", action = "store_true",
+            help = """Store the trajectories of individual simulations in a
+            compact binary format (*.drb) instead of text (*.drf) files.""")
+
+    parser.add_argument("--events", action = "store_true",
+            help = """Store the trajectories of individual simulations as text
+            files of structure changes (*.dre) instead of one line per output
+            time (*.drf).""")
+
+    parser.add_argument("--compress", default = None, choices = ('gz', 'xz', 'zst'),
+            help = """Compress the trajectory files of individual simulations
+            (zst requires the zstandard package). Compression runs in a
+            background thread.""")
+
+    parser.add_argument("--compress-output", action = "store_true",
+            help = """Also compress the combined output file(s) using the
+            --compress format, e.g. {name}.drf.gz.""")
+
+    parser.add_argument("--asyncio", action = "store_true",
+            help = """Read the output of up to --cpus Kinfold processes from one
+            event loop, instead of using one worker process per Kinfold call.""")
+
+    parser.add_argument("--keep-trajectories", action = "store_true",
+            help = """Write the trajectories of individual simulations to files in
+            --tmpdir. By default, trajectories are only counted in memory and
+            the simulations are only kept in the checkpoint, which then
+            cannot be discarded. Implied by --stream and --no-checkpoint.""")
+
+    parser.add_argument("--no-checkpoint", action = "store_true",
+            help = """Do not store the combined simulations in --tmpdir. By
+            default, only new simulation files are parsed when adding
+            simulations to an existing --tmpdir.""")
+
+    parser.add_argument("--stream", action = "store_true",
+            help = """Combine the simulation files one output time after the
+            other, rather than loading all simulations into memory at once.""")
+
+    parser.add_argument("--min-occupancy", type = float, default = 0, metavar = '<flt>',
+            help = """Do not write structures with lower occupancy at an output
+            time into the combined *.drf file.""")
+
+    parser.add_argument("--top-k", type = int, default = None, metavar = '<int>',
+            help = """Write at most the top-k most populated structures per
+            output time into the combined *.drf file.""")
+
+    parser.add_argument("--max-mass", type = float, default = None, metavar = '<flt>',
+            help = """Write the most populated structures per output time until
+            their cumulative occupancy reaches this value.""")
+
+    parser.add_argument("--other", action = "store_true",
+            help = """Write the occupancy of structures discarded by
+            --min-occupancy, --top-k and --max-mass as a single record with
+            ID -1 and structure "other".""")
+
+    parser.add_argument("--tolerance", type = float, default = None, metavar = '<flt>',
+            help = """Adaptive ensemble size: Repeat waves of --processes Kinfold
+            calls until the convergence statistic (see --convergence) drops
+            below this tolerance.""")
+
+    parser.add_argument("--convergence", default = 'se', choices = ('se', 'tv'),
+            help = """Convergence statistic for --tolerance: the maximum standard
+            error of an occupancy (se), or the maximum total variation distance
+            per output time between the simulations of odd and of even waves
+            (tv, requires at least two waves).""")
+
+    parser.add_argument("--time-budget", type = float, default = None, metavar = '<flt>',
+            help = """Do not start new waves after this wall-clock time [s].""")
+
+    parser.add_argument("--cpu-budget", type = float, default = None, metavar = '<flt>',
+            help = """Do not start new waves after this CPU time, including all
+            child processes [s].""")
+
     parser.add_argument("--t-ext", type = float, default = 0.02, metavar = '<flt>',
             help = """Time per nucleotide extension (the inverse of the transcription rate)
             [s/nt].""")
@@ -195,6 +460,40 @@ def parse_drkinfold_args(parser):
     parser.add_argument("--t-log", type = int, default = 30, metavar = '<int>',
             help = """Evenly space output *--t-log* times after transcription on a logarithmic time scale.""")
 
+    parser.add_argument("--t-stride", type = int, default = 1, metavar = '<int>',
+            help = """Only store every n-th output time in the trajectory files
+            and the combined output. The last output time is always stored.""")
+
+    parser.add_argument("--t-window", type = float, nargs = 2, default = None, 
+            metavar = '<flt>',
+            help = """Only store output times within this time window [s].""")
+
+    parser.add_argument("--preview", type = int, default = 0, metavar = '<int>',
+            help = """Also write a preview file {name}.preview.drf with every
+            n-th output time of the combined output.""")
+
+    parser.add_argument("--kp8", action = "store_true",
+            help = """Also write the distribution of structures at the last
+            output time to {name}.drf.kp8.""")
+
+    parser.add_argument("--npz", action = "store_true",
+            help = """Also write the combined output as arrays to {name}.npz: a
+            dense (times x structures) occupancy matrix, the structure table
+            with energies, and the entropy and effective number of structures
+            at every output time. Load with numpy.load.""")
+
+    parser.add_argument("--profile", action = "store_true",
+            help = """Report wall-clock and CPU time, throughput, I/O and memory
+            usage of the Kinfold calls and of combining the output.""")
+
+    parser.add_argument("--metrics", default = None, metavar = '<str>',
+            help = """Write the --profile metrics, including statistics of every
+            Kinfold call, to this JSON file.""")
+
+    parser.add_argument("--cprofile", default = None, metavar = '<str>',
+            help = """Profile the Python code of all stages in the main process
+            with cProfile and write the statistics to this file.""")
+
     parser.add_argument("-T", "--temp", type = float, default = 37.0, 
         metavar = '<flt>',
         help = 'Rescale energy parameters to a temperature of temp C.')
@@ -214,50 +513,212 @@ def main():
         description = 'DrKinfold: Cotranscriptional folding using Kinfold.')
     parse_drkinfold_args(parser)
     args = parser.parse_args()
+    metrics = Metrics(args.profile or args.metrics is not None, args.cprofile)
 
     # Read Input & Update Arguments
-    name, seq = parse_vienna_stdin(sys.stdin)
-    if args.name:
-        name = args.name
-    print(f'>{name}\n{seq}')
-
-    #
-    # Prepare the output times in the *.drf file format.
-    #
-    times = get_drf_output_times(len(seq), args.t_ext, args.t_end, args.t_lin, args.t_log)
-
-    #
-    # Put everything in one directory, update the file ID in case there are
-    # existing simulations.
-    #
-    fid = 1 # Set initial file ID according to what can already be found in tmpdir.
-    if os.path.exists(args.tmpdir):
-        for data in glob.glob(f'{args.tmpdir}/{name}.*.drf'):
-            ndata = data.split('/')[-1]
-            *pre, nfid, suf = ndata.split('.')
-            fid = max(fid, int(nfid)+1)
+    if args.batch:
+        sequences = parse_vienna_multifasta(sys.stdin)
     else:
+        name, seq = parse_vienna_stdin(sys.stdin)
+        sequences = [(args.name if args.name else name, seq)]
+    if not os.path.exists(args.tmpdir):
         os.mkdir(args.tmpdir)
 
+    if args.asyncio and args.stream:
+        raise SystemExit('--asyncio is incompatible with --stream.')
+    if args.tolerance is not None and (args.stream or not args.processes):
+        raise SystemExit('--tolerance requires --processes and is incompatible with --stream.')
+    prefix = None
+    if args.warm_start:
+        if args.keep_trajectories or args.stream or args.no_checkpoint:
+            raise SystemExit('--warm-start is incompatible with --keep-trajectories, --stream '
+                             'and --no-checkpoint.')
+        prefix = os.path.commonprefix([seq for _, seq in sequences])
+        if not prefix or any(len(seq) == len(prefix) for _, seq in sequences):
+            raise SystemExit('--warm-start requires a common prefix that is shorter than every sequence.')
+        print(f'[warm start:] The sequences share a prefix of {len(prefix)} nucleotides.')
+    elif (args.stream or args.no_checkpoint) and not args.keep_trajectories:
+        # Simulations that are only counted in memory would not be stored.
+        print('[WARNING:] --stream and --no-checkpoint imply --keep-trajectories.')
+        args.keep_trajectories = True
+
+    # Conversion factors between seconds and Kinfold's internal time units.
+    atupersec = args.k0
+    atupernuc = atupersec * args.t_ext
+    if args.binary and args.events:
+        raise SystemExit('Choose only one of --binary and --events.')
+    suffix = '.drb' if args.binary else '.dre' if args.events else '.drf'
+    if args.compress:
+        if args.binary:
+            raise SystemExit('--compress is not supported for --binary trajectories.')
+        suffix += f'.{args.compress}'
+    oext = f'.{args.compress}' if args.compress and args.compress_output else ''
+
+    times = dict()
+    for name, seq in sequences:
+        print(f'>{name}\n{seq}')
+        #
+        # Prepare the output times in the *.drf file format.
+        #
+        times[name] = get_drf_output_times(len(seq), args.t_ext, args.t_end, args.t_lin, args.t_log)
+    select = dict()
+    if args.t_stride > 1 or args.t_window:
+        for name, seq in sequences:
+            select[name] = select_drf_times(times[name], args.t_stride, args.t_window)
+
     #
-    # Do all the Kinfold calculations.
+    # Simulations that are only stored in a checkpoint cannot be discarded
+    # or ignored. Check this before doing new simulations.
     #
-    if args.processes:
-        # Conversion factors between seconds and Kinfold's internal time units.
-        atupersec = args.k0
-        atupernuc = atupersec * args.t_ext
-        totkftime = atupernuc * len(seq) + atupersec * args.t_end
-        with Pool(processes = args.cpus) as q:
-            multiple_results = [q.apply_async(run_kinfold, 
-                (times, f'{args.tmpdir}/{name}.{fid+x:03d}', seq, 
-                 args.num, atupernuc, atupersec, totkftime, args.temp, args.paramFile)) for x in range(args.processes)]
-            [res.get() for res in multiple_results]
+    ckeys = {name: dict(sequence = seq, t_ext = args.t_ext, t_end = args.t_end,
+                        t_lin = args.t_lin, t_log = args.t_log,
+                        t_stride = args.t_stride, t_window = args.t_window)
+             for name, seq in sequences}
+    for name, _ in sequences:
+        try:
+            check_drf_checkpoint(f'{args.tmpdir}/{name}.agg.npz', ckeys[name], 
+                                 f'{args.tmpdir}/{name}.*.dr[fbe]*',
+                                 ignore = args.stream or args.no_checkpoint)
+        except ValueError as err:
+            raise SystemExit(str(err))
 
     #
-    # Combine all drf files from individual simulations to one lage output file.
+    # Simulations are done in waves of --processes Kinfold calls per sequence.
+    # Without --tolerance, there is only one wave. Otherwise, new waves are
+    # started until the ensemble of every sequence has converged or the
+    # budget is exhausted.
     #
-    combine_drfs(f'{args.tmpdir}/{name}*.drf', f'{name}.drf', len(seq), times, use_counts = False)
+    waves = EnsembleWaves([name for name, _ in sequences], args.tolerance, args.convergence,
+                          args.time_budget, args.cpu_budget)
+    collected = {name: dict() for name, _ in sequences}
+
+    def run_jobs(jobs):
+        #
+        # Do all the Kinfold calculations. All sequences share the same pool of
+        # workers, long sequences are started first to reduce the tail latency.
+        # With --asyncio, all Kinfold processes are read from one event loop.
+        # Trajectories are counted in memory, and only written to files with
+        # --keep-trajectories.
+        #
+        if not jobs:
+            return []
+        jobs.sort(key = lambda job: len(job[1][2]), reverse = True)
+        with metrics.stage('kinfold', workers = min(len(jobs), args.cpus or os.cpu_count())):
+            if args.asyncio:
+                # All Kinfold output is parsed in this process.
+                cpu = cpu_times()[0]
+                results = run_kinfold_async([job for _, job in jobs], args.cpus)
+                metrics.count('kinfold', 'parse_cpu', cpu_times()[0] - cpu)
+                return results
+            from multiprocessing import Pool
+            with Pool(processes = args.cpus, initializer = _kinfold_worker) as q:
+                multiple_results = [q.apply_async(run_kinfold, job) for _, job in jobs]
+                try:
+                    return [res.get() for res in multiple_results]
+                except ChildProcessError as err:
+                    raise SystemExit(str(err))
+
+    def record_stats(stats):
+        stats.pop('final')
+        metrics.subprocess('kinfold', stats)
+        for key in ('lines', 'simulations', 'parse_cpu'):
+            if key in stats:
+                metrics.count('kinfold', key, stats[key])
+        metrics.count('kinfold', 'bytes_parsed', stats['bytes'])
+
+    for names in waves:
+        pending = [(name, seq) for name, seq in sequences if name in names]
+        # Simulations of previous waves are part of the checkpoint.
+        memory = {name: [] for name, _ in sequences}
+        #
+        # Put everything in one directory, update the file ID in case there are
+        # existing simulations.
+        #
+        if prefix:
+            #
+            # Simulate the shared prefix until the next nucleotide is
+            # transcribed. Every sequence is then continued from the final
+            # structures of the prefix simulations, one Kinfold call per
+            # distinct structure. The counts of the prefix and of the
+            # continuations are joined on the output times of every sequence.
+            #
+            split = len(prefix) * args.t_lin # First output time of the continuations.
+            pfid = next_file_id(f'{args.tmpdir}/{PREFIX}.*.err')
+            pjobs = [(PREFIX, (times[pending[0][0]][:split], f'{args.tmpdir}/{PREFIX}.{pfid+x:03d}', 
+                      prefix, args.num, atupernuc, atupersec, atupernuc * len(prefix), args.temp, 
+                      args.paramFile, None, None, args.kinfold_exe)) 
+                     for x in range(args.processes)]
+            presults = run_jobs(pjobs)
+            starts = Counter(ss for _, stats in presults for ss in stats['final'])
+            print(f'[warm start:] Continuing {sum(starts.values())} simulations '
+                  f'from {len(starts)} distinct prefix structures.')
+            jobs, tsplit = [], dict()
+            for name, seq in pending:
+                index = select.get(name, range(len(times[name])))
+                head = [i for i in index if i < split]
+                tail = [i - split for i in index if i >= split]
+                tsplit[name] = head
+                for (pc, pe, pnsim), _ in presults:
+                    memory[name].append(([pc[i] for i in head] + [dict() for _ in tail],
+                                         [pe[i] for i in head] + [dict() for _ in tail], pnsim))
+                fid = next_file_id(f'{args.tmpdir}/{name}.*.err')
+                ttimes = (times[name][split:] - len(prefix) * args.t_ext).clip(min = 0)
+                totkftime = atupernuc * (len(seq) - len(prefix)) + atupersec * args.t_end
+                jobs.extend((name, (ttimes, f'{args.tmpdir}/{name}.{fid+x:03d}', seq, num, 
+                             atupernuc, atupersec, totkftime, args.temp, args.paramFile, None,
+                             tail if name in select else None, args.kinfold_exe, 
+                             ss + '.', len(prefix) + 1))
+                            for x, (ss, num) in enumerate(starts.items()))
+            results = run_jobs(jobs)
+            for (name, job), (result, stats) in zip(jobs, results):
+                head = tsplit[name]
+                memory[name].append(([dict() for _ in head] + result[0], 
+                                     [dict() for _ in head] + result[1], 0))
+            for _, stats in presults + results:
+                record_stats(stats)
+        else:
+            jobs = []
+            for name, seq in pending:
+                fid = max(next_file_id(f'{args.tmpdir}/{name}.*.dr[fbe]*'),
+                          next_file_id(f'{args.tmpdir}/{name}.*.err'))
+                totkftime = atupernuc * len(seq) + atupersec * args.t_end
+                jobs.extend((name, (times[name], f'{args.tmpdir}/{name}.{fid+x:03d}', seq, 
+                             args.num, atupernuc, atupersec, totkftime, args.temp, args.paramFile,
+                             suffix if args.keep_trajectories else None, select.get(name),
+                             args.kinfold_exe)) 
+                            for x in range(args.processes))
+            results = run_jobs(jobs)
+            for (name, job), (result, stats) in zip(jobs, results):
+                record_stats(stats)
+                if job[9] is None:
+                    memory[name].append(result)
+                else: # Trajectory files are not parsed again.
+                    collected[name][f'{job[1]}{job[9]}'] = result
+
+        #
+        # Combine all drf files from individual simulations to one lage output
+        # file per sequence.
+        #
+        for name, seq in pending:
+            stimes = times[name]
+            if name in select:
+                stimes = [stimes[i] for i in select[name]]
+            previews = None
+            if args.preview:
+                previews = {f'{name}.preview.drf{oext}': select_drf_times(stimes, args.preview)}
+            with metrics.stage('combine'):
+                aggregate = combine_drfs(f'{args.tmpdir}/{name}.*.dr[fbe]*', f'{name}.drf{oext}',
+                            stimes, use_counts = False, stream = args.stream, cpus = args.cpus,
+                            min_occupancy = args.min_occupancy, top_k = args.top_k,
+                            max_mass = args.max_mass, other = args.other, previews = previews,
+                            get_kp8 = args.kp8, arrays = f'{name}.npz' if args.npz else None,
+                            aggregates = memory[name], collected = collected[name],
+                            checkpoint = None if args.no_checkpoint else f'{args.tmpdir}/{name}.agg.npz',
+                            checkpoint_key = ckeys[name])
+            metrics.count('combine', 'simulations', aggregate[2] if aggregate else 0)
+            if aggregate:
+                waves.update(name, aggregate[0], aggregate[2])
+    metrics.close(args.metrics)
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,169 @@
+#
+# drconverters.metrics
+#
+# Instrumentation of the DrKinfold and DrKinefold pipelines.
+#
+import json
+import time
+import cProfile
+import resource
+from contextlib import contextmanager
+
+from .utils import cpu_times
+
+
+def io_counters():
+    """Characters read and written by this process (Linux only).
+
+    Returns:
+      int, int: Bytes read and written, including cached I/O. None, None if
+        /proc/self/io is not available.
+    """
+    try:
+        with open('/proc/self/io') as io:
+            data = dict(line.split(': ') for line in io.read().splitlines())
+        return int(data['rchar']), int(data['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+class Metrics:
+    """Record wall-clock time, CPU time and throughput of pipeline stages.
+
+    Stages are timed with :meth:`stage`, repeated stages of the same name
+    are accumulated and stages may be nested. CPU time is split into the time of this process and
+    of its terminated child processes (e.g. Kinfold calls and pool
+    workers). A disabled instance records nothing.
+
+    Args:
+      enabled (bool, optional): Record metrics.
+      cprofile (str, optional): Profile the Python code of all stages with
+        cProfile and dump the statistics to this file.
+    """
+    def __init__(self, enabled = True, cprofile = None):
+        self.enabled = enabled or cprofile is not None
+        self.stages = dict()
+        self.subprocesses = []
+        self.cprofile = cprofile
+        self.profiler = cProfile.Profile() if cprofile else None
+        self.depth = 0 # Nested stages
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name, workers = None):
+        """Time a stage of the pipeline.
+
+        Args:
+          name (str): The name of the stage.
+          workers (int, optional): Number of parallel workers of the stage,
+            used to compute the pool utilization from :meth:`subprocess`.
+        """
+        if not self.enabled:
+            yield
+            return
+        wall, (cpu, ccpu), (rchar, wchar) = time.perf_counter(), cpu_times(), io_counters()
+        if self.profiler and self.depth == 0:
+            self.profiler.enable()
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            if self.profiler and self.depth == 0:
+                self.profiler.disable()
+            st = self.stages.setdefault(name, dict(calls = 0, wall = 0, cpu = 0, children_cpu = 0,
+                                                   bytes_read = 0, bytes_written = 0))
+            ncpu, nccpu = cpu_times()
+            nrchar, nwchar = io_counters()
+            st['calls'] += 1
+            st['wall'] += time.perf_counter() - wall
+            st['cpu'] += ncpu - cpu
+            st['children_cpu'] += nccpu - ccpu
+            if rchar is not None:
+                st['bytes_read'] += nrchar - rchar
+                st['bytes_written'] += nwchar - wchar
+            if workers:
+                st['workers'] = workers
+
+    def count(self, name, key, value):
+        """Add value to the counter key (e.g. lines, structures) of a stage."""
+        if self.enabled:
+            st = self.stages.setdefault(name, dict(calls = 0, wall = 0, cpu = 0, children_cpu = 0,
+                                                   bytes_read = 0, bytes_written = 0))
+            st[key] = st.get(key, 0) + value
+
+    def subprocess(self, name, stats):
+        """Record the statistics of one subprocess (e.g. a Kinfold call) of a stage.
+
+        Args:
+          name (str): The name of the stage.
+          stats (dict): At least the wall-clock time 'wall' in seconds.
+        """
+        if self.enabled:
+            self.subprocesses.append(dict(stats, stage = name))
+
+    def report(self):
+        """Return all metrics as a dictionary.
+
+        Throughput is reported per second of wall-clock time of a stage.
+        If the CPU time spent parsing subprocess output is counted as
+        'parse_cpu' (e.g. Kinfold output), lines and bytes parsed are
+        reported per second of that CPU time instead. The pool utilization is the total wall-clock time of the subprocesses
+        of a stage divided by (stage wall-clock time x workers).
+        """
+        stages = dict()
+        for name, st in self.stages.items():
+            st = dict(st)
+            for key in ('lines', 'structures', 'simulations', 'bytes_read', 'bytes_written'):
+                if st.get(key) and st['wall']:
+                    st[f'{key}_per_second'] = st[key] / st['wall']
+            for key in ('lines', 'bytes_parsed'):
+                if st.get(key) and st.get('parse_cpu'):
+                    st[f'{key}_per_second'] = st[key] / st['parse_cpu']
+            subs = [s for s in self.subprocesses if s['stage'] == name]
+            if subs:
+                st['subprocesses'] = len(subs)
+                st['subprocess_wall'] = sum(s['wall'] for s in subs)
+                if st.get('workers') and st['wall']:
+                    st['pool_utilization'] = st['subprocess_wall'] / (st['wall'] * st['workers'])
+            stages[name] = st
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu, ccpu = cpu_times()
+        return dict(wall = time.perf_counter() - self.start, cpu = cpu, children_cpu = ccpu,
+                    peak_rss_kb = own.ru_maxrss, children_peak_rss_kb = children.ru_maxrss,
+                    stages = stages, subprocesses = self.subprocesses)
+
+    def summary(self):
+        """Print a short summary of all stages."""
+        if not self.enabled:
+            return
+        report = self.report()
+        print(f"[profile:] total {report['wall']:.2f} s wall, {report['cpu']:.2f} s cpu, "
+              f"{report['children_cpu']:.2f} s cpu in child processes, "
+              f"peak RSS {report['peak_rss_kb']/1024:.1f} MiB "
+              f"(children {report['children_peak_rss_kb']/1024:.1f} MiB).")
+        for name, st in report['stages'].items():
+            line = (f"[profile:] {name}: {st['wall']:.2f} s wall, {st['cpu']:.2f} s cpu, "
+                    f"{st['children_cpu']:.2f} s child cpu, "
+                    f"{st['bytes_read']/2**20:.1f} MiB read, {st['bytes_written']/2**20:.1f} MiB written")
+            for key in ('lines', 'structures', 'simulations'):
+                if f'{key}_per_second' in st:
+                    line += f", {st[f'{key}_per_second']:.0f} {key}/s"
+            if 'pool_utilization' in st:
+                line += f", pool utilization {st['pool_utilization']:.1%}"
+            print(line + '.')
+
+    def write(self, jsonfile):
+        """Write all metrics to a JSON file."""
+        with open(jsonfile, 'w') as out:
+            json.dump(self.report(), out, indent = 2)
+
+    def close(self, jsonfile = None):
+        """Print the summary, write the JSON file and the cProfile statistics."""
+        self.summary()
+        if jsonfile:
+            self.write(jsonfile)
+        if self.profiler:
+            self.profiler.dump_stats(self.cprofile)
+            print(f'[profile:] cProfile statistics written to {self.cprofile}.')
+
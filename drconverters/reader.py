@@ -0,0 +1,140 @@
+#
+# drconverters.reader
+#
+# Random access to combined *.drf files.
+#
+import os
+import mmap
+import contextlib
+import heapq
+import numpy as np
+
+from .utils import strip_compression, write_drf_index
+
+
+def build_drf_index(drffile):
+    """Scan a combined *.drf file for the byte-offset index of its output times.
+
+    Used for files without (or with an outdated) index {drffile}.idx, see
+    :func:`drconverters.utils.write_drf_index`. The index is returned, not
+    written. Output times without any records cannot be recovered from the
+    file and are not indexed.
+
+    Args:
+      drffile (str): The uncompressed *.drf file.
+
+    Returns:
+      np.ndarray, np.ndarray: The output times and byte offsets.
+    """
+    times, offsets, last = [], [], None
+    with open(drffile, 'rb') as drf, mmap.mmap(drf.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+        pos = mm.find(b'\n') + 1
+        while pos < len(mm):
+            end = mm.find(b'\n', pos)
+            end = len(mm) if end < 0 else end
+            time = mm[pos:end].split(None, 2)[1]
+            if time != last:
+                times.append(float(time))
+                offsets.append(pos)
+                last = time
+            pos = end + 1
+        offsets.append(len(mm))
+    return np.array(times, dtype = float), np.array(offsets, dtype = np.int64)
+
+def load_drf_index(drffile):
+    """Load the index {drffile}.idx of a combined *.drf file.
+
+    Returns:
+      np.ndarray, np.ndarray: The output times and byte offsets, or None if
+        there is no index or the file size does not match the index.
+    """
+    idxfile = f'{drffile}.idx'
+    if not os.path.exists(idxfile):
+        return None
+    with np.load(idxfile) as data:
+        times, offsets = data['times'], data['offsets']
+    if len(offsets) != len(times) + 1 or offsets[-1] != os.path.getsize(drffile):
+        return None
+    return times, offsets
+
+class DrfReader:
+    """Random access to the output times of a combined *.drf file.
+
+    The file is memory-mapped and only the records of the requested output
+    times are read, located through the byte-offset index {drffile}.idx.
+    The index is written by :func:`drconverters.utils.combine_drfs`. If it
+    is missing or outdated, it is rebuilt and persisted, or kept in memory
+    if it cannot be written (e.g. in a read-only directory).
+
+    Records are returned as tuples (id, time, occupancy, structure, energy),
+    the occupancy column holds counts if the file was written with counts.
+
+    Args:
+      drffile (str): An uncompressed combined *.drf file.
+    """
+    def __init__(self, drffile):
+        if strip_compression(drffile) != drffile:
+            raise ValueError(f'Cannot memory-map compressed file: {drffile}')
+        index = load_drf_index(drffile)
+        if index is None:
+            index = build_drf_index(drffile)
+            try:
+                write_drf_index(drffile, *index)
+            except OSError:
+                with contextlib.suppress(OSError):
+                    os.remove(f'{drffile}.idx')
+        self.times, self.offsets = index
+        self.handle = open(drffile, 'rb')
+        self.mm = mmap.mmap(self.handle.fileno(), 0, access = mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.times)
+
+    def index(self, time):
+        """The index of the output time closest to time."""
+        i = int(np.searchsorted(self.times, time))
+        if i == len(self.times) or (i > 0 and time - self.times[i-1] <= self.times[i] - time):
+            i -= 1
+        return max(i, 0)
+
+    def records(self, i):
+        """All records of the output time with index i, in file order."""
+        records = []
+        for line in self.mm[self.offsets[i]:self.offsets[i+1]].decode().splitlines():
+            ni, time, occ, ss, en = line.split()
+            records.append((int(ni), float(time), float(occ), ss, float(en)))
+        return records
+
+    def at(self, time):
+        """All records of the output time closest to time."""
+        return self.records(self.index(time))
+
+    def time_range(self, tmin, tmax):
+        """Yield the records of all output times between tmin and tmax.
+
+        Yields:
+          float, list: The output time and its records.
+        """
+        start = int(np.searchsorted(self.times, tmin, side = 'left'))
+        stop = int(np.searchsorted(self.times, tmax, side = 'right'))
+        for i in range(start, stop):
+            yield float(self.times[i]), self.records(i)
+
+    def top(self, time, k = 10):
+        """The k most populated structures at the output time closest to time.
+
+        The record "other" of pruned structures is not a structure and is
+        never part of the result.
+        """
+        return heapq.nlargest(k, (rec for rec in self.at(time) if rec[0] >= 0), 
+                              key = lambda rec: rec[2])
+
+    def close(self):
+        self.mm.close()
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
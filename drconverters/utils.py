@@ -1,6 +1,14 @@
 import os
+import gzip
+import lzma
+import json
+import time
+import heapq
+import queue
+import threading
 from glob import glob
-import numpy as np
+from functools import partial, lru_cache
+from itertools import groupby
 
 
 def parse_vienna_stdin(stdin, chars='ACGUNTacgunt'):
@@ -30,79 +38,1404 @@ def parse_vienna_stdin(stdin, chars='ACGUNTacgunt'):
             seq += line
     return name, seq
 
+def parse_vienna_multifasta(stdin, chars='ACGUNTacgunt'):
+    """Parse names and sequences from file with (multi-)fasta format.
+
+    Args:
+      stdin (list): Input to parse, ususally :obj:`sys.stdin`
+      chars (string, optional): Allowed characters in a sequence.
+
+    Returns:
+      list: (name, sequence) tuples in the order of the input.
+    """
+    records = []
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] == '>':
+            records.append([line.split()[0][1:], ''])
+        else:
+            warn = set([x for x in line if x not in chars])
+            if len(warn):
+                raise SystemExit(f"Unsupported character(s) in RNA: {warn}")
+            if not records:
+                raise SystemExit("Every sequence needs a fasta header (>name).")
+            records[-1][1] += line
+    names = [name for name, _ in records]
+    if len(set(names)) != len(names):
+        raise SystemExit("Sequence names in fasta file must be unique!")
+    return [tuple(r) for r in records]
+
+def next_file_id(pattern):
+    """Return the next free file ID, given existing files {name}.{ID}.{suffix}.
+
+    The suffix may be followed by the extension of a compression format.
+
+    Args:
+      pattern (str): A glob pattern matching all existing files.
+
+    Returns:
+      int: One plus the highest existing ID, 1 if there are no files.
+    """
+    fid = 1
+    for data in glob(pattern):
+        *pre, nfid, suf = strip_compression(os.path.basename(data)).split('.')
+        fid = max(fid, int(nfid)+1)
+    return fid
+
 def get_drf_output_times(seqlen, t1, t8, t_lin, t_log):
-    times = np.array([0])
-    for nuc in range(seqlen):
-        ntime = np.linspace(times[-1], times[-1] + t1, t_lin + 1)
-        times = np.concatenate([times, ntime[1:]])
-    ntime = np.logspace(np.log10(times[-1]), np.log10(times[-1] + t8), t_log + 1)
-    return np.concatenate([times, ntime[1:]])
-
-def combine_drfs(drffiles, oname, seqlen, times, use_counts = False, get_kp8 = False):
-    #
-    # Collect data from all drf output files.
-    #
-    cdict = {t: dict() for t in range(len(times))} # Counts
-    edict = {t: dict() for t in range(len(times))} # Energy
-    idict, nid = dict(), 0 # Identity
-    nfiles, nsim = 0, 0
-    for data in glob(drffiles):
-        nfiles += 1
-        with open(data) as dat:
-            t = 0
+    """Calculate the output times of the *.drf file format.
+
+    There are t_lin evenly spaced output times per nucleotide extension and
+    t_log logarithmically spaced output times after transcription. The
+    output time with index t corresponds to t*t1/t_lin for
+    t <= seqlen*t_lin, see also :func:`split_drf_time_index`.
+
+    Args:
+      seqlen (int): Length of the full transcript.
+      t1 (float): Time per nucleotide extension.
+      t8 (float): Post-transcriptional simulation time.
+      t_lin (int): Number of output times per nucleotide extension (>= 1).
+      t_log (int): Number of output times after transcription.
+
+    Returns:
+      np.ndarray: seqlen*t_lin + t_log + 1 output times, starting at 0.
+    """
+    import numpy as np
+    ttime = seqlen * t1
+    times = np.empty(seqlen * t_lin + t_log + 1)
+    times[:seqlen * t_lin + 1] = np.arange(seqlen * t_lin + 1) * t1 / t_lin
+    times[seqlen * t_lin + 1:] = np.logspace(np.log10(ttime), 
+                                             np.log10(ttime + t8), t_log + 1)[1:]
+    return times
+
+def split_drf_time_index(t, seqlen, t_lin):
+    """Split output time indices into nucleotide, sub-step and log-step.
+
+    The inverse is t = nuc * t_lin + sub + log. During transcription, the
+    log-step is 0 and 0 <= sub < t_lin, after transcription nuc = seqlen,
+    sub = 0 and the log-step counts the post-transcriptional output times.
+
+    Args:
+      t (int, np.ndarray): Output time index (or indices).
+      seqlen (int): Length of the full transcript.
+      t_lin (int): Number of output times per nucleotide extension.
+
+    Returns:
+      (int, int, int): nucleotide, sub-step and log-step (or arrays thereof).
+    """
+    import numpy as np
+    log = np.maximum(np.subtract(t, seqlen * t_lin), 0)
+    nuc, sub = np.divmod(np.subtract(t, log), t_lin)
+    return nuc, sub, log
+
+def get_drf_transcript_lengths(seqlen, t_lin, t_log):
+    """The transcript length at every output time.
+
+    A transcript has length k for output times in the interval 
+    ((k-1)*t1, k*t1], the first output time has length 1.
+
+    Returns:
+      np.ndarray: An integer array of length seqlen*t_lin + t_log + 1.
+    """
+    import numpy as np
+    nuc, sub, _ = split_drf_time_index(np.arange(seqlen * t_lin + t_log + 1), seqlen, t_lin)
+    return np.maximum(nuc + (sub > 0), 1)
+
+def select_drf_times(times, stride = 1, window = None):
+    """Select a subset of output times by a stride and/or a time window.
+
+    Every stride-th output time within the window is selected, the last
+    output time of the window is always included.
+
+    Args:
+      times (list): The output times.
+      stride (int, optional): Select every stride-th output time.
+      window (tuple, optional): Only select output times t with
+        window[0] <= t <= window[1].
+
+    Returns:
+      list: The selected time indices.
+    """
+    index = [i for i, t in enumerate(times) if window is None or window[0] <= t <= window[1]]
+    select = index[::stride]
+    if index and select[-1] != index[-1]:
+        select.append(index[-1])
+    return select
+
+def _open_zstd(filename, mode = 'rt'):
+    try:
+        import zstandard
+    except ImportError:
+        raise SystemExit(f'Reading or writing {filename} requires the zstandard package.')
+    return zstandard.open(filename, mode)
+
+COMPRESSION = {'.gz': gzip.open, '.xz': lzma.open, '.lzma': lzma.open, '.zst': _open_zstd}
+
+def strip_compression(filename):
+    """Return filename without the extension of a supported compression format.
+    """
+    root, ext = os.path.splitext(filename)
+    return root if ext in COMPRESSION else filename
+
+class BackgroundWriter:
+    """Write text to a file handle in a separate thread.
+
+    Strings are buffered and handed over to the thread in blocks, such that
+    the caller does not wait for compression or for the file system.
+
+    Args:
+      handle (file): A text file handle, closed by :meth:`close`.
+      blocksize (int, optional): Number of characters per block.
+    """
+    def __init__(self, handle, blocksize = 2**16):
+        self.handle = handle
+        self.blocksize = blocksize
+        self.buffer, self.size = [], 0
+        self.error = None
+        self.queue = queue.Queue(maxsize = 64)
+        self.thread = threading.Thread(target = self._run, daemon = True)
+        self.thread.start()
+
+    def _run(self):
+        while (block := self.queue.get()) is not None:
+            if self.error is None:
+                try:
+                    self.handle.write(block)
+                except Exception as err:
+                    self.error = err
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.size += len(text)
+        if self.size >= self.blocksize:
+            self.flush()
+
+    def flush(self):
+        if self.error is not None:
+            raise self.error
+        if self.buffer:
+            self.queue.put(''.join(self.buffer))
+            self.buffer, self.size = [], 0
+
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        self.handle.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_compressed(filename, mode = 'rt'):
+    """Open a text file, compressed according to its extension.
+
+    Files ending with .gz, .xz/.lzma or .zst are (de)compressed with
+    gzip, lzma or zstandard (if installed). Compressed files opened for
+    writing are wrapped in a :class:`BackgroundWriter`, such that the
+    compression runs in a separate thread.
+
+    Args:
+      filename (str): Path to the file.
+      mode (str, optional): 'rt' (or 'r') for reading, 'wt' (or 'w') for writing.
+
+    Returns:
+      A file object.
+    """
+    mode = mode if mode.endswith('t') else mode + 't'
+    copen = COMPRESSION.get(os.path.splitext(filename)[1])
+    if copen is None:
+        return open(filename, mode)
+    if mode == 'wt':
+        return BackgroundWriter(copen(filename, mode))
+    return copen(filename, mode)
+
+def get_drf_time_keys(times):
+    """Format output times as written in the *.drf files of single simulations.
+
+    The same strings are used by the trajectory writers and by
+    :func:`combine_drfs` to validate the time column, which avoids float
+    comparisons when parsing.
+
+    Args:
+      times (list): The output times.
+
+    Returns:
+      list: The formatted output time for every time index.
+    """
+    return [f'{t:.9f}' for t in times]
+
+def check_drf_time(time, t, tkeys, drffile):
+    """Raise an error if the parsed time does not match the time index t.
+    """
+    if t < len(tkeys) and time == tkeys[t]:
+        return
+    tindex = {k: i for i, k in enumerate(tkeys)}
+    if time in tindex:
+        msg = f'found time {time} (index {tindex[time]}) at time index {t}'
+    else:
+        msg = f'time {time} is not an output time (expected {tkeys[t]} at index {t})'
+    raise ValueError(f'Inconsistent output times in {drffile}: {msg}. '
+                     'Was the data generated using different --t-lin/--t-log/--t-ext/--t-end?')
+
+class DrfWriter:
+    """Write the trajectory of one or more simulations as text *.drf file.
+
+    Every output time of every simulation is written as one line.
+
+    Args:
+      drffile (str): Path to the output file.
+      times (list): The output times of every simulation.
+    """
+    def __init__(self, drffile, times):
+        self.tkeys = get_drf_time_keys(times)
+        self.handle = open_compressed(drffile, 'w')
+        self.handle.write(f"id time occupancy structure energy\n")
+
+    def write(self, t, ss, en, idc = 0):
+        """Write structure ss with energy en (kcal/mol) at time index t."""
+        self.handle.write(f'{idc:>5d} {self.tkeys[t]:>13s} 1 {ss} {en:6.2f}\n')
+
+    def close(self):
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+DRB_MAGIC = b'DRB1'
+DRB_DTYPE = [('t', '<u4'), ('sid', '<u4'), ('en', '<i4')] # numpy record type
+
+class DrbWriter(DrfWriter):
+    """Write the trajectory of one or more simulations as binary *.drb file.
+
+    Structures are interned as integer IDs once per file, the structure with
+    ID i is stored in line i of a separate *.drs file. The *.drb file
+    starts with a magic string and the number of output times per
+    simulation, followed by fixed width records of time index, structure ID
+    and energy (in 10 cal/mol), see DRB_DTYPE.
+
+    Args:
+      drbfile (str): Path to the output file (should end with .drb).
+      times (list): The output times of every simulation.
+      bufsize (int, optional): Number of records buffered before writing.
+    """
+    def __init__(self, drbfile, times, bufsize = 2**16):
+        import numpy as np
+        self.handle = open(drbfile, 'wb')
+        self.handle.write(DRB_MAGIC + np.uint32(len(times)).tobytes())
+        self.shandle = open(drbfile[:-1] + 's', 'w')
+        self.sids = dict()
+        self.records = []
+        self.bufsize = bufsize
+
+    def write(self, t, ss, en, idc = 0):
+        """Write structure ss with energy en (kcal/mol) at time index t."""
+        sid = self.sids.get(ss)
+        if sid is None:
+            sid = self.sids[ss] = len(self.sids)
+            self.shandle.write(ss + '\n')
+        self.records.append((t, sid, int(round(en * 100))))
+        if len(self.records) >= self.bufsize:
+            self.flush()
+
+    def flush(self):
+        import numpy as np
+        np.array(self.records, dtype = DRB_DTYPE).tofile(self.handle)
+        self.records = []
+
+    def close(self):
+        self.flush()
+        self.handle.close()
+        self.shandle.close()
+
+class DreWriter(DrfWriter):
+    """Write the trajectory of one or more simulations as *.dre event file.
+
+    Only changes of structure or energy are written, one line per event
+    with the time index from which on the structure is observed. The header
+    contains the number of output times and the first and last output time,
+    every simulation is terminated by a line with only the number of output
+    times. The file size scales with the number of transitions instead of
+    the number of output times.
+
+    Args:
+      drefile (str): Path to the output file (should end with .dre).
+      times (list): The output times of every simulation.
+    """
+    def __init__(self, drefile, times):
+        tkeys = get_drf_time_keys(times)
+        self.ntimes = len(times)
+        self.handle = open_compressed(drefile, 'w')
+        self.handle.write(f"# dre {len(times)} {tkeys[0]} {tkeys[-1]}\n")
+        self.last = None
+
+    def write(self, t, ss, en, idc = 0):
+        """Write structure ss with energy en (kcal/mol) at time index t."""
+        event = (ss, f'{en:6.2f}')
+        if t == 0 or event != self.last:
+            self.handle.write(f'{t:>5d} {ss} {event[1]}\n')
+            self.last = event
+        if t == self.ntimes - 1:
+            self.handle.write(f'{self.ntimes:>5d}\n')
+
+def open_trajectory_writer(filename, times):
+    """Return a trajectory writer for *.drb, *.dre or (otherwise) *.drf files.
+
+    Text files (*.drf, *.dre) are compressed according to their extension,
+    e.g. *.drf.gz, see :func:`open_compressed`.
+    """
+    if filename.endswith('.drb'):
+        return DrbWriter(filename, times)
+    if strip_compression(filename).endswith('.dre'):
+        return DreWriter(filename, times)
+    return DrfWriter(filename, times)
+
+class TimeFilter:
+    """Forward only selected output times to another writer.
+
+    Has the same interface as :class:`DrfWriter`. Time indices refer to all
+    output times and are renumbered to the selection, i.e. the wrapped
+    writer must be opened with the selected output times.
+
+    Args:
+      writer (DrfWriter): The wrapped writer.
+      select (list): The selected time indices, see :func:`select_drf_times`.
+    """
+    def __init__(self, writer, select):
+        self.writer = writer
+        self.index = {t: i for i, t in enumerate(select)}
+
+    def write(self, t, ss, en, idc = 0):
+        """Write structure ss with energy en (kcal/mol) if t is selected."""
+        i = self.index.get(t)
+        if i is not None:
+            self.writer.write(i, ss, en, idc)
+
+    def close(self):
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class TrajectoryCounter:
+    """Count structures and energies of trajectories at every output time.
+
+    Has the same interface as :class:`DrfWriter`, and every structure can be
+    forwarded to another writer. Simulations are counted once all their
+    output times have been written.
+
+    Args:
+      times (list): The output times of every simulation.
+      writer (DrfWriter, optional): Forward all structures to this writer.
+    """
+    def __init__(self, times, writer = None):
+        self.ntimes = len(times)
+        self.writer = writer
+        self.cdict = [dict() for t in range(len(times))] # Counts
+        self.edict = [dict() for t in range(len(times))] # Energy
+        self.nsim = 0
+        self.lines = []
+
+    def write(self, t, ss, en, idc = 0):
+        """Add structure ss with energy en (kcal/mol) at time index t."""
+        if self.writer is not None:
+            self.writer.write(t, ss, en, idc)
+        self.lines.append((ss, int(round(en * 100))))
+        if len(self.lines) == self.ntimes:
+            for t, (ss, en) in enumerate(self.lines):
+                self.cdict[t][ss] = self.cdict[t].get(ss, 0) + 1
+                self.edict[t][ss] = en
+            self.lines = []
+            self.nsim += 1
+
+    def result(self):
+        """Return the counts, energies and number of simulations."""
+        return self.cdict, self.edict, self.nsim
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_drb(drbfile, ntimes, mmap = False):
+    """Read the simulations and structures from a *.drb file.
+
+    Args:
+      drbfile (str): Path to the *.drb file.
+      ntimes (int): Expected number of output times per simulation.
+      mmap (bool, optional): Memory-map the records instead of reading them.
+
+    Returns:
+      np.ndarray, list: A (simulations x times) array of records
+      (see DRB_DTYPE) and the list of structures indexed by structure ID.
+    """
+    import numpy as np
+    with open(drbfile, 'rb') as dat:
+        header = dat.read(8)
+    if header[:4] != DRB_MAGIC:
+        raise ValueError(f'{drbfile} is not a *.drb file.')
+    nt = int(np.frombuffer(header[4:], dtype = '<u4')[0])
+    if nt != ntimes:
+        raise ValueError(f'Inconsistent output times in {drbfile}: found {nt} output times '
+                         f'per simulation, expected {ntimes}. Was the data generated using '
+                         'different --t-lin/--t-log?')
+    if mmap:
+        records = np.memmap(drbfile, dtype = DRB_DTYPE, mode = 'r', offset = 8)
+    else:
+        records = np.fromfile(drbfile, dtype = DRB_DTYPE, offset = 8)
+    if len(records) % ntimes:
+        print(f'[WARNING:] Ignoring incomplete simulation in {drbfile}.')
+    records = records[:len(records) - len(records) % ntimes].reshape(-1, ntimes)
+    if not (records['t'] == np.arange(ntimes)).all():
+        raise ValueError(f'Inconsistent output times in {drbfile}.')
+    with open(drbfile[:-1] + 's') as dat:
+        structures = dat.read().split()
+    return records, structures
+
+def read_dre(drefile, times):
+    """Read the change events of all simulations in a *.dre file.
+
+    Args:
+      drefile (str): Path to the *.dre file.
+      times (list): The output times of every simulation.
+
+    Returns:
+      list: One list of events (time index, structure, energy in 10 cal/mol)
+      per complete simulation.
+    """
+    tkeys = get_drf_time_keys(times)
+    simulations, events = [], []
+    with open_compressed(drefile) as dat:
+        header = dat.readline().split()
+        if header[:2] != ['#', 'dre']:
+            raise ValueError(f'{drefile} is not a *.dre file.')
+        if header[2:] != [str(len(tkeys)), tkeys[0], tkeys[-1]]:
+            raise ValueError(f'Inconsistent output times in {drefile}: found {header[2]} '
+                             f'output times from {header[3]} to {header[4]}, expected '
+                             f'{len(tkeys)} from {tkeys[0]} to {tkeys[-1]}. Was the data '
+                             'generated using different --t-lin/--t-log/--t-ext/--t-end?')
+        for line in dat:
+            event = line.split()
+            if len(event) == 1: # End of simulation
+                simulations.append(events)
+                events = []
+            else:
+                events.append((int(event[0]), event[1], int(round(float(event[2])*100))))
+    if events:
+        print(f'[WARNING:] Ignoring incomplete simulation in {drefile}.')
+    return simulations
+
+def _drf_simulation_offsets(drffile, ntimes):
+    """Find the byte offsets of all complete simulations in a *.drf file.
+
+    Args:
+      drffile (str): Path to a *.drf file of one or more simulations.
+      ntimes (int): Number of output times (lines) per simulation.
+
+    Returns:
+      list: Byte offsets of the first line of every complete simulation.
+    """
+    offsets = []
+    with open(drffile, 'rb') as dat:
+        pos = len(dat.readline()) # header
+        for i, line in enumerate(dat):
+            if i % ntimes == 0:
+                offsets.append(pos)
+            pos += len(line)
+    if offsets and (i + 1) % ntimes:
+        print(f'[WARNING:] Ignoring incomplete simulation in {drffile}.')
+        offsets.pop()
+    return offsets
+
+def _iter_drf_simulation(drffile, offset, tkeys, chunksize = 1024):
+    """Yield structure and energy at every output time of a single simulation.
+
+    The file is reopened for every chunk of (at most chunksize) lines, such
+    that many simulations can be read in lockstep without keeping files open.
+    """
+    t = 0
+    while t < len(tkeys):
+        with open(drffile, 'rb') as dat:
+            dat.seek(offset)
+            lines = [dat.readline() for _ in range(min(chunksize, len(tkeys) - t))]
+            offset = dat.tell()
+        for line in lines:
+            _, time, occ, ss, en = line.decode().split()
+            if time != tkeys[t]:
+                check_drf_time(time, t, tkeys, drffile)
+            yield ss, int(round(float(en)*100))
+            t += 1
+
+def _iter_drb_simulation(records, structures):
+    """Yield structure and energy at every output time of a single simulation.
+    """
+    for sid, en in zip(records['sid'], records['en']):
+        yield structures[sid], int(en)
+
+def _read_drf_events(drffile, tkeys):
+    """Read all complete simulations of a *.drf file as change events.
+
+    Returns:
+      list: One list of events (time index, structure, energy in 10 cal/mol)
+      per complete simulation, see :func:`read_dre`.
+    """
+    simulations, events, last = [], [], None
+    t = 0
+    with open_compressed(drffile) as dat:
+        dat.readline() # header
+        for line in dat:
+            _, time, occ, ss, en = line.split()
+            if time != tkeys[t]:
+                check_drf_time(time, t, tkeys, drffile)
+            if t == 0 or (ss, en) != last:
+                events.append((t, ss, int(round(float(en)*100))))
+                last = (ss, en)
+            t += 1
+            if t == len(tkeys):
+                simulations.append(events)
+                t, events = 0, []
+    if events:
+        print(f'[WARNING:] Ignoring incomplete simulation in {drffile}.')
+    return simulations
+
+def _iter_dre_simulation(events, ntimes):
+    """Yield structure and energy at every output time of a single simulation.
+    """
+    bounds = [t for t, _, _ in events[1:]] + [ntimes]
+    for (t, ss, en), end in zip(events, bounds):
+        for _ in range(t, end):
+            yield ss, en
+
+class StructureInterner:
+    """Assign stable integer IDs to secondary structures.
+
+    Structures that differ only by trailing unpaired nucleotides (i.e. the
+    same structure at different transcript lengths) share an ID. IDs are
+    assigned in the order of first occurrence. Lookups of structure strings
+    are memoized in a bounded LRU cache, see :meth:`cache_info`.
+
+    Args:
+      structures (list, optional): Structures of existing IDs (without
+        trailing unpaired nucleotides), e.g. from :meth:`structures`.
+      maxsize (int, optional): Size of the LRU cache.
+    """
+    def __init__(self, structures = (), maxsize = 2**16):
+        self.ids = {ss: ni for ni, ss in enumerate(structures)}
+        self.intern = lru_cache(maxsize = maxsize)(self._intern)
+
+    def _intern(self, ss):
+        key = ss.rstrip('.')
+        ni = self.ids.get(key)
+        if ni is None:
+            ni = self.ids[key] = len(self.ids)
+        return ni
+
+    def __len__(self):
+        return len(self.ids)
+
+    def structures(self):
+        """All interned structures, ordered by ID."""
+        return list(self.ids)
+
+    def cache_info(self):
+        """Hits, misses, maxsize and currsize of the LRU cache."""
+        return self.intern.cache_info()
+
+def _prune_drf_slice(counts, nsim, min_occupancy = 0, top_k = None, max_mass = None):
+    """Select the most populated structures of one output time.
+
+    Structures below min_occupancy are discarded, the others are taken from
+    a heap in order of decreasing counts (ties in order of first occurrence)
+    until top_k structures or a cumulative occupancy of max_mass is reached.
+
+    Returns:
+      set: The selected structures.
+    """
+    mincount = min_occupancy * nsim
+    heap = [(-num, i, ss) for i, (ss, num) in enumerate(counts.items()) if num >= mincount]
+    if max_mass is None:
+        if top_k is not None:
+            heap = heapq.nsmallest(top_k, heap)
+        return set(ss for _, _, ss in heap)
+    heapq.heapify(heap)
+    keep, mass, limit = set(), 0, max_mass * nsim
+    while heap and mass < limit and (top_k is None or len(keep) < top_k):
+        num, _, ss = heapq.heappop(heap)
+        keep.add(ss)
+        mass -= num
+    return keep
+
+class DrfSliceWriter:
+    """Write the output times of a *.drf file, sorted by free energy.
+
+    The ID, structure and energy of every record are formatted once per
+    structure (and again only if its energy changes), occupancies once per
+    count. Each output time is joined into one block and written with a
+    single call. Structure IDs are assigned at first output by the
+    StructureInterner.
+
+    Args:
+      interner (:class:`StructureInterner`): Assigns the structure IDs.
+      nsim (int): The number of simulations.
+      use_counts (bool, optional): Write counts instead of occupancies.
+      prune (dict, optional): Only write the structures selected by
+        :func:`_prune_drf_slice`, called with these keyword arguments.
+      other (bool, optional): Write the occupancy of the pruned structures
+        as a single record with ID -1 and structure "other", at their
+        occupancy-weighted mean free energy.
+    """
+    def __init__(self, interner, nsim, use_counts = False, prune = None, other = False):
+        self.interner = interner
+        self.nsim = nsim
+        self.use_counts = use_counts
+        self.prune = prune
+        self.other = other
+        self.records = dict() # ss -> (energy, formatted ID, formatted structure and energy)
+        self.occupancies = dict() # count -> formatted occupancy
+
+    def _occupancy(self, num):
+        occ = self.occupancies[num] = f'{num:5d}' if self.use_counts else f'{num/self.nsim:03.4f}'
+        return occ
+
+    def write(self, df, time, counts, energies):
+        """Write all structures of one output time.
+
+        Args:
+          df (file): The output file.
+          time (float): The output time.
+          counts (dict): Structure counts at this time.
+          energies (dict): Structure energies (in 10 cal/mol) at this time.
+
+        Returns:
+          int: The number of bytes written.
+        """
+        keep = counts if self.prune is None else _prune_drf_slice(counts, self.nsim, **self.prune)
+        records, occupancies = self.records, self.occupancies
+        tstr = f' {time:03.3f} '
+        lines = []
+        for ss in sorted([ss for ss in energies if ss in keep], key = energies.__getitem__):
+            en = energies[ss]
+            rec = records.get(ss)
+            if rec is None or rec[0] != en:
+                rec = records[ss] = (en, f'{self.interner.intern(ss):5d}', 
+                                     f' {ss} {en/100:6.2f}\n')
+            num = counts[ss]
+            occ = occupancies.get(num) or self._occupancy(num)
+            lines.append(rec[1] + tstr + occ + rec[2])
+        if self.other and len(keep) < len(counts):
+            rest = [(num, energies[ss]) for ss, num in counts.items() if ss not in keep]
+            num = sum(n for n, _ in rest)
+            en = sum(n * e for n, e in rest) / num
+            lines.append(f'{-1:5d}{tstr}{occupancies.get(num) or self._occupancy(num)}'
+                         f' other {en/100:6.2f}\n')
+        block = ''.join(lines)
+        df.write(block)
+        return len(block)
+
+class DrfArrays:
+    """Collect output times for a dense times x structures occupancy matrix.
+
+    Output times are stored sparsely (columns and counts) until :meth:`save`
+    writes the dense matrix together with a structure table and per-time
+    summary statistics. Structures that differ only by trailing unpaired
+    nucleotides share a column, like the IDs of the *.drf file.
+    """
+    def __init__(self):
+        self.columns = dict() # Structure without trailing unpaired nucleotides -> column
+        self.energies = [] # Energy (10 cal/mol) per column, at the last time it was added
+        self.rows = [] # (columns, counts) per output time
+
+    def add(self, counts, energies):
+        """Add the structure counts and energies of the next output time."""
+        import numpy as np
+        columns, last = self.columns, self.energies
+        cols = np.empty(len(counts), dtype = np.int64)
+        for i, ss in enumerate(counts):
+            key = ss.rstrip('.')
+            col = columns.get(key)
+            if col is None:
+                col = columns[key] = len(columns)
+                last.append(0)
+            last[col] = energies[ss]
+            cols[i] = col
+        self.rows.append((cols, np.fromiter(counts.values(), dtype = np.int64, 
+                                            count = len(counts))))
+
+    def save(self, npzfile, times, nsim, interner = None):
+        """Write all arrays to a *.npz file.
+
+        The file contains the arrays times (T), structures (S, dot-bracket
+        without trailing unpaired nucleotides), ids (S, the *.drf structure
+        IDs, -1 for structures that were never written), energy (S, kcal/mol
+        at the last output time a structure was present), occupancy (T x S),
+        entropy (T, Shannon entropy in nats), effective (T, the effective
+        number of structures exp(entropy)) and nsim. Columns of structures
+        with an ID come first, in the order of their IDs.
+
+        Args:
+          npzfile (str): The output file.
+          times (list): The output times of all added rows.
+          nsim (int): The number of simulations.
+          interner (:class:`StructureInterner`, optional): The structure IDs
+            of the *.drf file.
+        """
+        import numpy as np
+        structures = list(self.columns)
+        ids = [interner.ids.get(ss, -1) if interner else -1 for ss in structures]
+        order = sorted(range(len(structures)), key = lambda c: (ids[c] < 0, ids[c], c))
+        perm = np.empty(len(order), dtype = np.int64)
+        perm[order] = np.arange(len(order))
+        occupancy = np.zeros((len(self.rows), len(order)), dtype = np.float32)
+        entropy = np.zeros(len(self.rows))
+        for t, (cols, nums) in enumerate(self.rows):
+            p = nums / nsim
+            np.add.at(occupancy[t], perm[cols], p)
+            entropy[t] = -np.sum(p * np.log(p))
+        np.savez(npzfile, times = np.array(times, dtype = float),
+                 structures = np.array([structures[c] for c in order], dtype = str),
+                 ids = np.array([ids[c] for c in order], dtype = np.int64),
+                 energy = np.array([self.energies[c] for c in order], dtype = float) / 100,
+                 occupancy = occupancy, entropy = entropy, effective = np.exp(entropy),
+                 nsim = np.array(nsim))
+
+DRF_HEADER = "id time occupancy structure energy\n"
+
+def write_drf_index(drffile, times, offsets):
+    """Write the byte-offset index {drffile}.idx of a combined *.drf file.
+
+    The index is a *.npz file with the output times and the byte offset of
+    the first record of every output time, followed by the file size. See
+    :class:`drconverters.reader.DrfReader`.
+
+    Args:
+      drffile (str): The uncompressed *.drf file.
+      times (list): The output times, in the order of the file.
+      offsets (list): The byte offsets (len(times) + 1).
+    """
+    import numpy as np
+    with open(f'{drffile}.idx', 'wb') as idx:
+        np.savez(idx, times = np.array(times, dtype = float), 
+                 offsets = np.array(offsets, dtype = np.int64))
+
+def _write_kp8(oname, counts, energies):
+    with open(f'{oname}.kp8', 'w') as df:
+        for s in sorted(energies, key = lambda x: energies[x]):
+            df.write(f'{s} {counts[s]:>5d} {energies[s]/100:6.2f}\n')
+
+def _stream_drfs(drffiles, outputs, times, use_counts, get_kp8, buffersize, 
+                 prune = None, other = False, arrays = None, index = True):
+    """Combine *.drf files one output time after the other.
+
+    All simulations are advanced in lockstep, the data of one output time
+    is written to the output file and then discarded. Only the structure
+    IDs (see :class:`StructureInterner`) grow with the number of distinct
+    structures. The simulations of uncompressed *.drf files share a buffer
+    of buffersize lines, i.e. each of them reads buffersize // nsim lines
+    at a time. Outputs maps output file names to the time indices
+    written into them, the first output is the main output. The main output
+    times are also collected into the *.npz file arrays, see
+    :class:`DrfArrays`. With index, the byte-offset index of every
+    uncompressed output is written, see :func:`write_drf_index`.
+    """
+    tkeys = get_drf_time_keys(times)
+    streams, positions = [], [] # positions of simulations in *.drf files
+    for data in drffiles:
+        if data.endswith('.drb'):
+            records, structures = read_drb(data, len(times), mmap = True)
+            streams.extend(_iter_drb_simulation(rec, structures) for rec in records)
+            continue
+        if strip_compression(data).endswith('.dre'):
+            streams.extend(_iter_dre_simulation(events, len(times)) 
+                           for events in read_dre(data, times))
+            continue
+        if strip_compression(data) != data:
+            # Compressed files cannot be read at random offsets efficiently,
+            # their simulations are kept in memory as change events instead.
+            streams.extend(_iter_dre_simulation(events, len(times)) 
+                           for events in _read_drf_events(data, tkeys))
+            continue
+        for offset in _drf_simulation_offsets(data, len(times)):
+            positions.append((len(streams), data, offset))
+            streams.append(None)
+    chunksize = max(1, buffersize // len(positions)) if positions else 1
+    for i, data, offset in positions:
+        streams[i] = _iter_drf_simulation(data, offset, tkeys, chunksize)
+    nsim = len(streams)
+    print(f'[collecting data:] Streaming {nsim} simulations from {len(drffiles)} files.')
+
+    for output in outputs:
+        if os.path.exists(output):
+            print(f"[WARNING:] Overwriting existing file: {output}")
+    writer = DrfSliceWriter(StructureInterner(), nsim, use_counts, prune, other)
+    handles = [(open_compressed(output, 'w'), set(select), [len(DRF_HEADER)]) 
+               for output, select in outputs.items()]
+    for df, _, _ in handles:
+        df.write(DRF_HEADER)
+    collector = DrfArrays() if arrays else None
+    for t in range(len(times)):
+        counts, energies = dict(), dict()
+        for sim in streams:
+            ss, en = next(sim)
+            counts[ss] = counts.get(ss, 0) + 1
+            energies[ss] = en
+        for df, select, offsets in handles:
+            if t in select:
+                offsets.append(offsets[-1] + writer.write(df, times[t], counts, energies))
+        if collector and t in handles[0][1]:
+            collector.add(counts, energies)
+    for (output, select), (df, _, offsets) in zip(outputs.items(), handles):
+        df.close()
+        if index and strip_compression(output) == output:
+            write_drf_index(output, [times[t] for t in sorted(select)], offsets)
+    if collector:
+        collector.save(arrays, [times[t] for t in outputs[next(iter(outputs))]], 
+                       nsim, writer.interner)
+    if get_kp8:
+        _write_kp8(next(iter(outputs)), counts, energies)
+
+def _collect_drfs(drffiles, times):
+    """Count structures and energies of all simulations in the given files.
+
+    Args:
+      drffiles (list): Paths to *.drf (*.drb, *.dre) files of individual simulations.
+      times (list): The output times of every simulation.
+
+    Returns:
+      list, list, int: Structure counts and energies (in 10 cal/mol) per
+      output time, as well as the number of parsed simulations.
+    """
+    cdict = [dict() for t in range(len(times))] # Counts
+    edict = [dict() for t in range(len(times))] # Energy
+    nsim = 0
+    tkeys = get_drf_time_keys(times)
+    for data in drffiles:
+        if data.endswith('.drb'):
+            nsim += _collect_drb(data, len(times), cdict, edict)
+            continue
+        if strip_compression(data).endswith('.dre'):
+            nsim += _collect_dre(data, times, cdict, edict)
+            continue
+        with open_compressed(data) as dat:
+            t, lines = 0, []
             for i, line in enumerate(dat):
                 if i == 0:
                     continue
                 _, time, occ, ss, en = line.split()
-                # NOTE: If the line below breaks, then probably because of old
-                # data that was generated using a different t-lin and/or t-log.
-                assert np.isclose(float(time), times[t])
-                cdict[t][ss] = cdict[t].get(ss, 0) + 1
-                edict[t][ss] = int(round(float(en)*100))
-                future = '.' * (seqlen - len(ss))
-                if ss+future not in idict:
-                    idict[ss+future] = nid
-                    nid += 1
+                if time != tkeys[t]:
+                    check_drf_time(time, t, tkeys, data)
+                lines.append((ss, en))
                 t += 1
                 if t == len(times):
-                    t = 0
+                    for t, (ss, en) in enumerate(lines):
+                        cdict[t][ss] = cdict[t].get(ss, 0) + 1
+                        edict[t][ss] = int(round(float(en)*100))
+                    t, lines = 0, []
                     nsim += 1
-    print(f'[collecting data:] Parsed {nsim} simulations from {nfiles} files.')
+            if lines:
+                print(f'[WARNING:] Ignoring incomplete simulation in {data}.')
+    return cdict, edict, nsim
+
+def _collect_drb(drbfile, ntimes, cdict, edict):
+    """Add counts and energies of all simulations in a *.drb file (in place).
+
+    Structures are added in the order of first occurrence, and the last
+    energy of a structure takes precedence, exactly as when parsing the
+    equivalent text *.drf file.
+
+    Returns:
+      int: The number of simulations in the file.
+    """
+    import numpy as np
+    records, structures = read_drb(drbfile, ntimes)
+    nsim = len(records)
+    records = records.ravel()
+    keys = records['t'].astype(np.int64) * len(structures) + records['sid']
+    ukeys, first, counts = np.unique(keys, return_index = True, return_counts = True)
+    _, last = np.unique(keys[::-1], return_index = True)
+    energies = records['en'][len(keys) - 1 - last]
+    order = np.argsort(first)
+    for t, sid, num, en in zip((ukeys[order] // len(structures)).tolist(), 
+                               (ukeys[order] % len(structures)).tolist(),
+                               counts[order].tolist(), energies[order].tolist()):
+        ss = structures[sid]
+        cdict[t][ss] = cdict[t].get(ss, 0) + num
+        edict[t][ss] = en
+    return nsim
+
+def _collect_dre(drefile, times, cdict, edict):
+    """Add counts and energies of all simulations in a *.dre file (in place).
+
+    Every event is an interval of output times. Instead of counting every
+    output time, only the start and end of each interval are recorded
+    (a sparse difference array), and the counts are accumulated in one
+    sweep over the output times. Heaps of the active intervals of every
+    structure (with lazy deletion) give the first simulation (for the order
+    of first occurrence) and the last simulation (whose energy takes
+    precedence), exactly as when parsing the equivalent text *.drf file.
+
+    Returns:
+      int: The number of simulations in the file.
+    """
+    ntimes = len(times)
+    simulations = read_dre(drefile, times)
+    starts = [[] for t in range(ntimes + 1)]
+    ends = [[] for t in range(ntimes + 1)]
+    for sim, events in enumerate(simulations):
+        bounds = [t for t, _, _ in events[1:]] + [ntimes]
+        for (t, ss, en), end in zip(events, bounds):
+            starts[t].append((ss, sim, en))
+            ends[end].append((ss, sim, t))
+    active = dict() # ss -> [count, first heap, last heap, ended intervals]
+    for t in range(ntimes):
+        for ss, sim, start in ends[t]:
+            act = active[ss]
+            act[0] -= 1
+            if act[0] == 0:
+                del active[ss]
+            else: # Remove from both heaps once it reaches the top.
+                act[3][(sim, start)] = 2
+        for ss, sim, en in starts[t]:
+            act = active.get(ss)
+            if act is None:
+                act = active[ss] = [0, [], [], dict()]
+            act[0] += 1
+            heapq.heappush(act[1], (sim, t))
+            heapq.heappush(act[2], (-sim, -t, en))
+        order = []
+        for ss, (num, first, last, ended) in active.items():
+            for heap, sign in ((first, 1), (last, -1)):
+                while (sign * heap[0][0], sign * heap[0][1]) in ended:
+                    key = (sign * heap[0][0], sign * heap[0][1])
+                    heapq.heappop(heap)
+                    ended[key] -= 1
+                    if ended[key] == 0:
+                        del ended[key]
+            order.append((first[0][0], ss, num, last[0][2]))
+        for _, ss, num, en in sorted(order):
+            cdict[t][ss] = cdict[t].get(ss, 0) + num
+            edict[t][ss] = en
+    return len(simulations)
+
+def _merge_drf_counts(cdict, edict, pcdict, pedict):
+    """Merge partial counts and energies into cdict and edict (in place).
+
+    The merge is associative, counts are summed up and energies of the
+    partial (later) data take precedence. Merging partial results of
+    consecutive shards in order is equivalent to parsing all files at once.
+    """
+    for counts, energies, pcounts, penergies in zip(cdict, edict, pcdict, pedict):
+        for ss, num in pcounts.items():
+            counts[ss] = counts.get(ss, 0) + num
+        energies.update(penergies)
+
+def _collect_drfs_parallel(drffiles, times, cpus):
+    """Parse consecutive shards of drffiles in parallel and merge the results.
+    """
+    from multiprocessing import Pool
+    nshards = min(len(drffiles), 4 * (cpus or os.cpu_count() or 1))
+    size = -(-len(drffiles) // nshards)
+    shards = [drffiles[i:i+size] for i in range(0, len(drffiles), size)]
+    cdict = [dict() for t in range(len(times))]
+    edict = [dict() for t in range(len(times))]
+    nsim = 0
+    with Pool(processes = cpus) as p:
+        for pcdict, pedict, pnsim in p.imap(partial(_collect_drfs, times = times), shards):
+            _merge_drf_counts(cdict, edict, pcdict, pedict)
+            nsim += pnsim
+    return cdict, edict, nsim
+
+def _file_stat(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def check_drf_checkpoint(checkpoint, key, drffiles, ignore = False):
+    """Check whether a persisted aggregate of simulations is up to date.
+
+    A checkpoint is outdated if the parameters changed, or if any of the
+    aggregated files changed or is missing. Outdated checkpoints are
+    ignored, unless they contain simulations that are not stored in files
+    (see the aggregates of :func:`combine_drfs`). These would be lost.
+
+    Args:
+      checkpoint (str): Path to the checkpoint (*.npz) file.
+      key (dict): Parameters the aggregate depends on.
+      drffiles (str): A glob pattern matching all trajectory files.
+      ignore (bool, optional): The checkpoint is not going to be used, e.g.
+        in stream mode.
+
+    Returns:
+      bool: True if the checkpoint exists and is up to date.
+
+    Raises:
+      ValueError: If the checkpoint is outdated or ignored, but contains
+        simulations that are not stored in trajectory files.
+    """
+    import numpy as np
+    if not os.path.exists(checkpoint):
+        return False
+    with np.load(checkpoint) as data:
+        meta = json.loads(str(data['meta']))
+    stats = {os.path.basename(f): _file_stat(f) for f in glob(drffiles)}
+    if ignore:
+        reason = 'The checkpoint is ignored'
+    elif meta['key'] != json.loads(json.dumps(key)):
+        reason = 'Parameters changed'
+    elif any(stats.get(f) != stat for f, stat in meta['files'].items()):
+        reason = 'Files changed since last checkpoint'
+    else:
+        return True
+    if meta.get('memory'):
+        raise ValueError(f'{reason}, but {checkpoint} contains {meta["memory"]} simulations '
+                         'that are not stored in trajectory files. '
+                         'Remove the checkpoint to discard them.')
+    if not ignore:
+        print(f'[checkpoint:] {reason}, ignoring {checkpoint}.')
+    return False
+
+def load_drf_checkpoint(checkpoint, key, ntimes):
+    """Load a persisted aggregate of simulations.
+
+    Args:
+      checkpoint (str): Path to the checkpoint (*.npz) file.
+      key (dict): Parameters the aggregate depends on, e.g. sequence and
+        output times. The checkpoint is only valid if the keys match.
+      ntimes (int): Number of output times.
+
+    Returns:
+      tuple: (cdict, edict, nsim, files, interner, memory), where files maps
+      the names of aggregated files to their size and modification time,
+      interner is a :class:`StructureInterner` with the stored structure IDs
+      and memory is the number of simulations that are only stored in the
+      checkpoint, or None if there is no valid checkpoint.
+    """
+    import numpy as np
+    if not os.path.exists(checkpoint):
+        return None
+    with np.load(checkpoint) as data:
+        meta = json.loads(str(data['meta']))
+        if meta['key'] != json.loads(json.dumps(key)):
+            print(f'[checkpoint:] Parameters changed, ignoring {checkpoint}.')
+            return None
+        structures = data['structures'].tolist()
+        ids = data['ids'].tolist()
+        rt, rsid, rnum, ren = (data[x].tolist() for x in ('t', 'sid', 'count', 'energy'))
+    cdict = [dict() for t in range(ntimes)]
+    edict = [dict() for t in range(ntimes)]
+    for t, sid, num, en in zip(rt, rsid, rnum, ren):
+        cdict[t][structures[sid]] = num
+        edict[t][structures[sid]] = en
+    return cdict, edict, meta['nsim'], meta['files'], StructureInterner(ids), meta.get('memory', 0)
+
+def save_drf_checkpoint(checkpoint, key, cdict, edict, nsim, files, interner, memory = 0):
+    """Persist an aggregate of simulations, see :func:`load_drf_checkpoint`.
+    """
+    import numpy as np
+    sids, rows = dict(), []
+    for t, (counts, energies) in enumerate(zip(cdict, edict)):
+        for ss, num in counts.items():
+            sid = sids.setdefault(ss, len(sids))
+            rows.append((t, sid, num, energies[ss]))
+    rt, rsid, rnum, ren = zip(*rows) if rows else ([], [], [], [])
+    meta = {'key': key, 'nsim': nsim, 'files': files, 'memory': memory}
+    tmpfile = checkpoint + '.tmp.npz'
+    np.savez(tmpfile, meta = np.array(json.dumps(meta)),
+             structures = np.array(list(sids), dtype = str),
+             ids = np.array(interner.structures(), dtype = str),
+             t = np.array(rt, dtype = np.uint32),
+             sid = np.array(rsid, dtype = np.uint32),
+             count = np.array(rnum, dtype = np.int64),
+             energy = np.array(ren, dtype = np.int32))
+    os.replace(tmpfile, checkpoint)
+
+def combine_drfs(drffiles, oname, times, use_counts = False, get_kp8 = False,
+                 stream = False, buffersize = 2**16, cpus = 1, 
+                 checkpoint = None, checkpoint_key = None, collected = None,
+                 min_occupancy = 0, top_k = None, max_mass = None, other = False,
+                 select = None, previews = None, aggregates = None, arrays = None,
+                 index = True):
+    """Combine *.drf files of individual simulations into one *.drf file.
+
+    Args:
+      drffiles (str): A glob pattern matching all input files. Text (*.drf),
+        binary (*.drb) and event (*.dre) trajectory files are supported, text
+        files may be compressed (e.g. *.drf.gz, see :func:`open_compressed`).
+      oname (str): Name of the output *.drf file, compressed according to
+        its extension (e.g. *.drf.gz).
+      times (list): The output times of every simulation.
+      use_counts (bool, optional): Write counts instead of occupancies.
+      get_kp8 (bool, optional): Write the final distribution to {oname}.kp8.
+      stream (bool, optional): Advance all simulations in lockstep and write
+        one output time after the other. Memory is then bounded by the
+        structures of a single output time, rather than the whole ensemble.
+      buffersize (int, optional): Total number of lines buffered for all
+        simulations in stream mode.
+      cpus (int, optional): Number of worker processes used to parse the
+        input files. None uses all available cpus. The output is identical
+        to the serial result. Ignored in stream mode.
+      checkpoint (str, optional): Path to a persisted aggregate. Only files
+        that are not part of the checkpoint are parsed and the checkpoint is
+        updated before any output is written. Ignored in stream mode.
+      checkpoint_key (dict, optional): Parameters of the simulations, the
+        checkpoint is discarded if they differ from the stored parameters,
+        see :func:`check_drf_checkpoint`.
+      collected (dict, optional): Maps input files to their counts,
+        energies and number of simulations, e.g. from a
+        :class:`TrajectoryCounter`. These files are not parsed again.
+      min_occupancy (float, optional): Do not write structures with lower
+        occupancy at an output time.
+      top_k (int, optional): Write at most top_k structures per output time.
+      max_mass (float, optional): Write the most populated structures of an
+        output time until their cumulative occupancy reaches max_mass.
+      other (bool, optional): Write the occupancy of all structures discarded
+        by min_occupancy, top_k and max_mass as a single record "other".
+        The returned aggregate, the checkpoint and the kp8 file always
+        contain all structures.
+      select (list, optional): Only write these time indices to oname, see
+        :func:`select_drf_times`.
+      previews (dict, optional): Maps names of additional output files to
+        the time indices written into them, e.g. a low resolution preview.
+        All outputs are written from the same data, in stream mode in the
+        same pass over the input files.
+      aggregates (list, optional): Counts, energies and number of
+        simulations that are not stored in files (e.g. from a
+        :class:`TrajectoryCounter`), merged after all files. They are part
+        of the checkpoint, but not of the stored trajectories, such that
+        the checkpoint cannot be discarded anymore. Not supported in stream
+        mode.
+      arrays (str, optional): Write the occupancy matrix of the output times
+        of oname, the structure table and per-time entropies to this *.npz
+        file, see :class:`DrfArrays`.
+      index (bool, optional): Write the byte-offset index {output}.idx of
+        every uncompressed output file, for random access with
+        :class:`drconverters.reader.DrfReader`.
+
+    Returns:
+      list, list, int: Counts and energies per output time and the number
+        of simulations of the combined ensemble (None in stream mode).
+    """
+    prune = None
+    if min_occupancy or top_k is not None or max_mass is not None:
+        prune = dict(min_occupancy = min_occupancy, top_k = top_k, max_mass = max_mass)
+    outputs = {oname: range(len(times)) if select is None else select}
+    outputs.update(previews or dict())
+    if stream:
+        if aggregates:
+            raise ValueError('Simulations in memory cannot be combined in stream mode.')
+        if checkpoint:
+            check_drf_checkpoint(checkpoint, checkpoint_key, drffiles, ignore = True)
+        return _stream_drfs(sorted(glob(drffiles)), outputs, times, 
+                            use_counts, get_kp8, buffersize, prune, other, arrays, index)
+    #
+    # Collect data from all drf output files.
+    #
+    state = None
+    if checkpoint and check_drf_checkpoint(checkpoint, checkpoint_key, drffiles):
+        state = load_drf_checkpoint(checkpoint, checkpoint_key, len(times))
+    drffiles = sorted(glob(drffiles))
+    if state is not None:
+        cdict, edict, nsim, files, interner, memory = state
+        newfiles = [f for f in drffiles if os.path.basename(f) not in files]
+        print(f'[checkpoint:] Loaded {nsim} simulations from {checkpoint}.')
+    else:
+        cdict = [dict() for t in range(len(times))]
+        edict = [dict() for t in range(len(times))]
+        nsim, files, interner, memory = 0, dict(), StructureInterner(), 0
+        newfiles = drffiles
+
+    collected = collected or dict()
+    pnsim = 0
+    for done, group in groupby(newfiles, key = lambda f: f in collected):
+        if done:
+            partials = [collected[f] for f in group]
+        else:
+            group = list(group)
+            if cpus == 1 or len(group) < 2:
+                partials = [_collect_drfs(group, times)]
+            else:
+                partials = [_collect_drfs_parallel(group, times, cpus)]
+        for pcdict, pedict, num in partials:
+            _merge_drf_counts(cdict, edict, pcdict, pedict)
+            pnsim += num
+    nsim += pnsim
+    files.update((os.path.basename(f), _file_stat(f)) for f in newfiles)
+    print(f'[collecting data:] Parsed {pnsim} simulations from {len(newfiles)} files.')
+    if aggregates:
+        mnsim = 0
+        for pcdict, pedict, num in aggregates:
+            _merge_drf_counts(cdict, edict, pcdict, pedict)
+            mnsim += num
+        nsim += mnsim
+        memory += mnsim
+        print(f'[collecting data:] Added {mnsim} simulations from memory.')
+    if checkpoint:
+        # Save first, simulations in memory are lost if an output step fails.
+        save_drf_checkpoint(checkpoint, checkpoint_key, cdict, edict, nsim, files, interner, memory)
     #
     # Write the final vector into a separate file for potential further analysis
     #
     if get_kp8:
         st = len(times)-1
-        with open(f'{oname}.kp8', 'w') as df:
-            for s in sorted(edict[st], key = lambda x: edict[st][x]):
-                df.write(f'{s} {cdict[st][s]:>5d} {edict[st][s]/100:6.2f}\n')
-    #
-    # Transform the count dict into an occupancy dict!
-    #
-    if use_counts:
-        odict = cdict
-    else:
-        odict = {t: dict() for t in range(len(times))} # Occupancy
-        for t in sorted(cdict):
-            for ss in cdict[t]:
-                odict[t][ss] = cdict[t][ss]/nsim
+        _write_kp8(oname, cdict[st], edict[st])
     #
-    # Write *.drf output file.
+    # Write *.drf output files.
     #
-    if os.path.exists(oname):
-        print(f"[WARNING:] Overwriting existing file: {oname}")
-    with open(oname, 'w') as df:
-        df.write(f"id time occupancy structure energy\n")
-        for t in sorted(odict):
-            time = times[t]
-            for (ss, en) in sorted(edict[t].items(), key = lambda x: x[1]):
-                if ss not in odict[t]:
-                    continue
-                occu = odict[t][ss]
-                future = '.' * (seqlen - len(ss))
-                ni = idict[ss+future]
-                if use_counts:
-                    df.write(f'{ni:5d} {times[t]:03.3f} {occu:5d} {ss} {en/100:6.2f}\n')
-                else:
-                    df.write(f'{ni:5d} {times[t]:03.3f} {occu:03.4f} {ss} {en/100:6.2f}\n')
- 
+    writer = DrfSliceWriter(interner, nsim, use_counts, prune, other)
+    for output, select in outputs.items():
+        if os.path.exists(output):
+            print(f"[WARNING:] Overwriting existing file: {output}")
+        offsets = [len(DRF_HEADER)]
+        with open_compressed(output, 'w') as df:
+            df.write(DRF_HEADER)
+            for t in select:
+                offsets.append(offsets[-1] + writer.write(df, times[t], cdict[t], edict[t]))
+        if index and strip_compression(output) == output:
+            write_drf_index(output, [times[t] for t in select], offsets)
+    if arrays:
+        collector = DrfArrays()
+        for t in outputs[oname]:
+            collector.add(cdict[t], edict[t])
+        collector.save(arrays, [times[t] for t in outputs[oname]], nsim, interner)
+    return cdict, edict, nsim
+
+def cpu_times():
+    """CPU time of this process and of its terminated child processes.
+
+    Returns:
+      float, float: CPU seconds (user + system) of this process and of its
+        terminated children.
+    """
+    import resource
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime)
+
+def drf_convergence(cdict, nsim, half = None):
+    """Convergence statistics of an ensemble of simulations.
+
+    The standard error of an occupancy p estimated from n simulations is
+    sqrt(p*(1-p)/n). The total variation distance between two distributions
+    is half the sum of absolute differences of their occupancies. It is
+    computed between a subset of the simulations and the remaining ones,
+    e.g. the simulations of odd and of even waves (a split-half comparison).
+
+    Args:
+      cdict (list): Counts of structures per output time.
+      nsim (int): The number of simulations.
+      half (tuple, optional): Counts of structures per output time and the
+        number of simulations of a subset of the ensemble.
+
+    Returns:
+      float, float: The maximum standard error of an occupancy and the
+        maximum total variation distance between the subset and the
+        remaining simulations over all output times. The latter is infinite
+        if there is no subset or if either part is empty.
+    """
+    se = 0
+    for counts in cdict:
+        if counts:
+            # p*(1-p) is monotonic in the distance of p to 0.5.
+            p = min((num/nsim for num in counts.values()), key = lambda x: abs(x - 0.5))
+            se = max(se, p * (1 - p))
+    se = (se / nsim) ** 0.5 if nsim else float('inf')
+    if half is None or half[1] in (0, nsim):
+        return se, float('inf')
+    hcdict, hnsim = half
+    tv = 0
+    for counts, hcounts in zip(cdict, hcdict):
+        diff = sum(abs(hcounts.get(ss, 0)/hnsim - (num - hcounts.get(ss, 0))/(nsim - hnsim))
+                   for ss, num in counts.items())
+        tv = max(tv, diff / 2)
+    return se, tv
+
+class EnsembleWaves:
+    """Waves of simulations until the ensembles of all sequences converged.
+
+    Iterating yields the names of the sequences that need more simulations
+    in the next wave. Without a tolerance, there is only one wave.
+    Otherwise, the combined ensemble of every sequence is passed to
+    :meth:`update` after every wave, and new waves are started until every
+    ensemble has converged or a budget is exhausted.
+
+    Args:
+      names (list): The names of all sequences.
+      tolerance (float, optional): The maximum convergence statistic.
+      convergence (str, optional): The convergence statistic, the standard
+        error (se) or the split-half total variation distance between the
+        simulations of odd and even waves (tv), see :func:`drf_convergence`.
+      time_budget (float, optional): Do not start new waves after this
+        wall-clock time [s].
+      cpu_budget (float, optional): Do not start new waves after this CPU
+        time, including all child processes [s].
+    """
+    def __init__(self, names, tolerance = None, convergence = 'se', 
+                 time_budget = None, cpu_budget = None):
+        self.pending = list(names)
+        self.tolerance = tolerance
+        self.convergence = convergence
+        self.time_budget = time_budget
+        self.cpu_budget = cpu_budget
+        self.wave = 0
+        self.converged = set()
+        self.last = dict() # The counts of the previous wave.
+        self.halves = dict() # The counts of all odd waves.
+
+    def __iter__(self):
+        start, cpu0 = time.time(), sum(cpu_times())
+        while True:
+            self.wave += 1
+            yield list(self.pending)
+            if self.tolerance is None:
+                return
+            self.pending = [name for name in self.pending if name not in self.converged]
+            if not self.pending:
+                print(f'[convergence:] All ensembles converged after {self.wave} waves.')
+                return
+            if self.time_budget is not None and time.time() - start >= self.time_budget:
+                print(f'[convergence:] Time budget exhausted after {self.wave} waves, '
+                      f'not converged: {", ".join(self.pending)}.')
+                return
+            if self.cpu_budget is not None and sum(cpu_times()) - cpu0 >= self.cpu_budget:
+                print(f'[convergence:] CPU budget exhausted after {self.wave} waves, '
+                      f'not converged: {", ".join(self.pending)}.')
+                return
+
+    def update(self, name, cdict, nsim):
+        """Record the combined ensemble of a sequence after the current wave.
+
+        Returns:
+          bool: True if the ensemble has converged.
+        """
+        if self.tolerance is None:
+            return False
+        hcdict, hnsim = self.halves.get(name, ([dict() for _ in cdict], 0))
+        if self.wave % 2:
+            lcdict, lnsim = self.last.get(name, ([dict() for _ in cdict], 0))
+            hcdict = [{ss: hcounts.get(ss, 0) + num - lcounts.get(ss, 0) 
+                       for ss, num in counts.items() if hcounts.get(ss, 0) + num > lcounts.get(ss, 0)}
+                      for counts, hcounts, lcounts in zip(cdict, hcdict, lcdict)]
+            hnsim += nsim - lnsim
+            self.halves[name] = hcdict, hnsim
+        self.last[name] = cdict, nsim
+        se, tv = drf_convergence(cdict, nsim, (hcdict, hnsim))
+        print(f'[convergence:] {name}, wave {self.wave}: {nsim} simulations, '
+              f'max. standard error {se:.4f}, max. split-half total variation {tv:.4f}.')
+        if (se if self.convergence == 'se' else tv) <= self.tolerance:
+            self.converged.add(name)
+        return name in self.converged
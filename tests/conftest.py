@@ -0,0 +1,53 @@
+#
+# Shared fixtures: synthetic trajectories of individual simulations.
+#
+import random
+import pytest
+
+from drconverters.utils import (get_drf_output_times,
+                                get_drf_transcript_lengths,
+                                open_trajectory_writer)
+
+SEQLEN, T_EXT, T_END, T_LIN, T_LOG = 20, 0.02, 30, 4, 6
+
+
+def random_trajectory(rnd, tlens, nstruct = 4, change = 0.2):
+    """Structure and energy at every output time of a synthetic simulation.
+
+    At every output time, the structure changes with probability change to
+    one of nstruct hairpins of the current transcript length.
+    """
+    ss, en = None, None
+    for tlen in tlens:
+        if ss is None or rnd.random() < change:
+            k = rnd.randrange(min(nstruct, tlen // 3 + 1))
+            en = round(-k - rnd.random(), 2)
+            ss = '(' * k + '.' * (tlen - 2 * k) + ')' * k
+        ss = ss + '.' * (tlen - len(ss))
+        yield ss, en
+
+
+@pytest.fixture
+def seqlen():
+    return SEQLEN
+
+
+@pytest.fixture
+def times():
+    return get_drf_output_times(SEQLEN, T_EXT, T_END, T_LIN, T_LOG)
+
+
+@pytest.fixture
+def write_trajectories(tmp_path, times):
+    """Write synthetic trajectory files {name}.NNN{suffix}, return a glob pattern."""
+    def write(suffix, nfiles = 3, nsim = 5, seed = 0, name = 'sim', 
+              times = times, seqlen = SEQLEN, t_lin = T_LIN):
+        rnd = random.Random(seed)
+        tlens = get_drf_transcript_lengths(seqlen, t_lin, len(times) - seqlen * t_lin - 1)
+        for x in range(nfiles):
+            with open_trajectory_writer(str(tmp_path / f'{name}.{x:03d}{suffix}'), times) as writer:
+                for _ in range(nsim):
+                    for t, (ss, en) in enumerate(random_trajectory(rnd, tlens)):
+                        writer.write(t, ss, en)
+        return str(tmp_path / f'{name}.*{suffix}')
+    return write
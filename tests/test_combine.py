@@ -0,0 +1,118 @@
+import os
+import filecmp
+import numpy as np
+import pytest
+
+from drconverters.utils import combine_drfs
+
+SUFFIXES = ['.drf', '.drb', '.dre', '.drf.gz', '.drf.xz', '.drf.zst', '.dre.gz']
+
+
+def read_drf(drffile):
+    """The records (id, time, occupancy, structure, energy) per output time."""
+    records = dict()
+    with open(drffile) as drf:
+        for line in drf.readlines()[1:]:
+            ni, time, occ, ss, en = line.split()
+            records.setdefault(time, []).append((int(ni), time, float(occ), ss, float(en)))
+    return list(records.values())
+
+
+@pytest.fixture
+def reference(tmp_path, times, write_trajectories):
+    pattern = write_trajectories('.drf', name = 'ref')
+    aggregate = combine_drfs(pattern, str(tmp_path / 'reference.drf'), times)
+    assert aggregate[2] == 15
+    return str(tmp_path / 'reference.drf')
+
+
+@pytest.mark.parametrize('suffix', SUFFIXES)
+def test_combine_formats(tmp_path, times, write_trajectories, reference, suffix):
+    if suffix.endswith('.zst'):
+        pytest.importorskip('zstandard')
+    pattern = write_trajectories(suffix)
+    combine_drfs(pattern, str(tmp_path / 'out.drf'), times)
+    assert filecmp.cmp(tmp_path / 'out.drf', reference, shallow = False)
+
+
+@pytest.mark.parametrize('suffix', SUFFIXES)
+@pytest.mark.parametrize('mode', [dict(stream = True), dict(stream = True, buffersize = 1), 
+                                  dict(cpus = 2)])
+def test_combine_modes(tmp_path, times, write_trajectories, reference, suffix, mode):
+    if suffix.endswith('.zst'):
+        pytest.importorskip('zstandard')
+    pattern = write_trajectories(suffix)
+    combine_drfs(pattern, str(tmp_path / 'out.drf'), times, **mode)
+    assert filecmp.cmp(tmp_path / 'out.drf', reference, shallow = False)
+
+
+def test_combine_checkpoint(tmp_path, seqlen, times, write_trajectories, reference, capsys):
+    pattern = write_trajectories('.drf')
+    os.rename(tmp_path / 'sim.002.drf', tmp_path / 'later')
+    kwargs = dict(checkpoint = str(tmp_path / 'sim.agg.npz'), checkpoint_key = dict(seqlen = seqlen))
+    combine_drfs(pattern, str(tmp_path / 'out.drf'), times, **kwargs)
+    os.rename(tmp_path / 'later', tmp_path / 'sim.002.drf')
+    capsys.readouterr()
+    aggregate = combine_drfs(pattern, str(tmp_path / 'out.drf'), times, **kwargs)
+    assert 'Parsed 5 simulations from 1 files' in capsys.readouterr().out
+    assert aggregate[2] == 15
+    # Structure IDs of the checkpoint are kept, new structures get new IDs.
+    assert [[rec[1:] for rec in recs] for recs in read_drf(tmp_path / 'out.drf')] == \
+           [[rec[1:] for rec in recs] for recs in read_drf(reference)]
+    os.rename(tmp_path / 'out.drf', tmp_path / 'first.drf')
+    combine_drfs(pattern, str(tmp_path / 'out.drf'), times, **kwargs)
+    assert 'Parsed 0 simulations from 0 files' in capsys.readouterr().out
+    assert filecmp.cmp(tmp_path / 'out.drf', tmp_path / 'first.drf', shallow = False)
+
+
+@pytest.mark.parametrize('prune', [dict(min_occupancy = 0.2), dict(top_k = 2), 
+                                   dict(max_mass = 0.5), dict(top_k = 3, max_mass = 0.8)])
+@pytest.mark.parametrize('stream', [False, True])
+def test_combine_pruning(tmp_path, times, write_trajectories, reference, prune, stream):
+    pattern = write_trajectories('.drf')
+    combine_drfs(pattern, str(tmp_path / 'out.drf'), times, 
+                 stream = stream, other = True, **prune)
+    npruned = 0
+    for full, pruned in zip(read_drf(reference), read_drf(tmp_path / 'out.drf')):
+        kept = [rec for rec in pruned if rec[0] >= 0]
+        other = [rec for rec in pruned if rec[0] < 0]
+        # The kept records are unchanged (except for the IDs, which are
+        # only assigned to written structures) and the most populated ones.
+        assert all(rec[1:] in [r[1:] for r in full] for rec in kept)
+        occu = sorted((rec[2] for rec in full), reverse = True)
+        assert sorted((rec[2] for rec in kept), reverse = True) == occu[:len(kept)]
+        assert all(rec[2] >= prune.get('min_occupancy', 0) for rec in kept)
+        assert len(kept) <= prune.get('top_k', len(full))
+        if 'max_mass' in prune:
+            assert sum(occu[:len(kept) - 1]) < prune['max_mass']
+            assert len(kept) == prune.get('top_k') or sum(occu[:len(kept)]) >= prune['max_mass']
+        # Structures that are not written are summarized as "other".
+        if len(kept) < len(full):
+            npruned += 1
+            assert len(other) == 1 and other[0][3] == 'other'
+            assert other[0][2] == pytest.approx(sum(occu[len(kept):]), abs = 1e-3)
+        else:
+            assert not other
+    assert npruned
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_combine_arrays(tmp_path, times, write_trajectories, reference, stream):
+    pattern = write_trajectories('.drf')
+    combine_drfs(pattern, str(tmp_path / 'out.drf'), times, 
+                 stream = stream, arrays = str(tmp_path / 'out.npz'))
+    with np.load(tmp_path / 'out.npz') as data:
+        assert data['nsim'] == 15
+        assert np.allclose(data['times'], times)
+        assert np.allclose(data['occupancy'].sum(axis = 1), 1)
+        assert data['entropy'] == pytest.approx(
+                [-sum(p * np.log(p) for p in row if p) for row in data['occupancy']], abs = 1e-5)
+        assert np.allclose(data['effective'], np.exp(data['entropy']))
+        # Columns are ordered by the structure IDs of the *.drf file.
+        assert data['ids'].tolist() == list(range(len(data['ids'])))
+        for t, records in enumerate(read_drf(reference)):
+            occu = np.zeros(len(data['ids']))
+            for ni, _, occ, ss, en in records:
+                assert data['structures'][ni] == ss.rstrip('.')
+                occu[ni] += occ
+            assert np.allclose(data['occupancy'][t], occu, atol = 1e-4)
@@ -0,0 +1,108 @@
+import os
+import sys
+import random
+import filecmp
+import subprocess
+import pytest
+
+from drconverters.utils import get_drf_output_times, get_drf_transcript_lengths
+from drconverters.drkinefold import helices_to_db, parse_kinefold_structure, rnm_to_drf
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def random_helices(n, rnd, tries = 20):
+    """Non-overlapping, possibly crossing helices (i, j, k) on n nucleotides."""
+    used, helices = set(), []
+    for _ in range(tries):
+        k = rnd.randint(1, 4)
+        i = rnd.randrange(n)
+        j = rnd.randrange(n)
+        sides = set(range(i, i + k)) | set(range(j - k + 1, j + 1))
+        if i + k <= j - k + 1 and not sides & used:
+            used |= sides
+            helices.append((i, j, k))
+    return helices
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_helices_to_db(seed):
+    RNA = pytest.importorskip('RNA')
+    rnd = random.Random(seed)
+    n = rnd.randint(10, 120)
+    helices = random_helices(n, rnd)
+    ptable = [n] + [0] * n
+    for i, j, k in helices:
+        for x in range(k):
+            ptable[i + x + 1], ptable[j - x + 1] = j - x + 1, i + x + 1
+    assert helices_to_db(n, helices) == RNA.db_from_ptable(ptable)
+
+
+def test_parse_kinefold_structure():
+    line1 = ' A U[C G G G G G]C U C U[G U U G]G U U[C U C C C G^C A A C]G C U A C C'
+    line2 = " - - -5- - - - - - - - - -6- - - - - - -5' - - - - -6' - - - - - - - -"
+    assert parse_kinefold_structure(line1, line2) == (
+            'AUCGGGGGCUCUGUUGGUUCUCCCGCAACGCUACC', 
+            '..((((((....[[[[...))))))]]]]......')
+
+
+def test_get_drf_transcript_lengths():
+    # A transcript has length k for output times in ((k-1)*t_ext, k*t_ext].
+    assert get_drf_transcript_lengths(3, 4, 2).tolist() == [
+            1, 1, 1, 1, 1, 2, 2, 2, 2, 3, 3, 3, 3, 3, 3]
+
+
+def test_rnm_to_drf_transcript_lengths(tmp_path):
+    rnmfile = tmp_path / 'x.rnm'
+    rnmfile.write_text('< x\nGGACCA\n'
+                       '[G G]A[C C]| -0.40 kcal/mol  reached at 1.000 ms, for 5 nts\n'
+                       ' -1- - -1\'H 1 helices\n'
+                       '[G G]A[C C]A| -0.50 kcal/mol  reached at 500.000 ms, for 6 nts\n'
+                       ' -1- - -1\' -H 1 helices\n')
+    times = get_drf_output_times(6, 0.02, 30, 4, 3)
+    rnm_to_drf(str(rnmfile), str(tmp_path / 'x.drf'), times, 0.02, 4)
+    with open(tmp_path / 'x.drf') as drf:
+        lines = [line.split() for line in drf.readlines()[1:]]
+    assert [len(ss) for _, _, _, ss, _ in lines] == (
+            [1] * 5 + [2] * 4 + [3] * 4 + [4] * 4 + [5] * 4 + [6] * 7)
+    # The first snapshot is reached 5 * t_ext + 1 ms after the start.
+    assert [ss for _, _, _, ss, _ in lines[20:22]] == ['.....', '((.)).']
+
+
+FAKE_KINEFOLD = f'{sys.executable} {os.path.join(ROOT, "benchmarks", "fake_kinefold.py")}'
+
+
+@pytest.mark.parametrize('mode', [['--stream'], ['--binary'], ['--events', '--compress', 'xz'],
+                                  ['--cpus', '2'], ['--no-checkpoint']])
+def test_drkinefold_modes(tmp_path, mode):
+    def drkinefold(*args):
+        subprocess.run([sys.executable, '-m', 'drconverters.drkinefold', 
+                        '--kinefold-exe', FAKE_KINEFOLD, '--t-log', '5', *args],
+                       input = '>t\nUUAGUUGUGCCGCAGCGAAGUAGUGCUUGAAAUAUGCGAC\n', text = True, 
+                       cwd = tmp_path, check = True, stdout = subprocess.DEVNULL)
+    # Kinefold simulations are random, the *.rnm files are converted again.
+    drkinefold('-p', '3')
+    os.rename(tmp_path / 't.drf', tmp_path / 'reference.drf')
+    drkinefold('-p', '0', *mode)
+    assert filecmp.cmp(tmp_path / 't.drf', tmp_path / 'reference.drf', shallow = False)
+
+
+def test_rnm_to_drf_missing_file(tmp_path):
+    times = get_drf_output_times(6, 0.02, 30, 4, 3)
+    with pytest.raises(FileNotFoundError):
+        rnm_to_drf(str(tmp_path / 'x.rnm'), str(tmp_path / 'x.drf'), times, 0.02, 4)
+    assert not os.path.exists(tmp_path / 'x.drf')
+
+
+def test_drkinefold_skips_failed_jobs(tmp_path):
+    # Kinefold fails for the second job, $0 is the Kinefold input file.
+    failing = f'sh -c \'case "$0" in *.002.in) exit 1;; esac; exec {FAKE_KINEFOLD} "$0"\''
+    proc = subprocess.run([sys.executable, '-m', 'drconverters.drkinefold', '-p', '3',
+                           '--kinefold-exe', failing, '--t-log', '5'],
+                          input = '>t\nUUAGUUGUGCCGCAGCGAAGUAGUGCUUGAAAUAUGCGAC\n', text = True,
+                          cwd = tmp_path, check = True, capture_output = True)
+    assert 'Kinefold call for drkinefold/t.002 failed' in proc.stdout
+    assert 'Parsed 2 simulations from 2 files' in proc.stdout
+    assert sorted(os.listdir(tmp_path / 'drkinefold')) == [
+            't.001.drf', 't.001.in', 't.001.rnm', 't.001.rnm.log', 't.002.in', 
+            't.003.drf', 't.003.in', 't.003.rnm', 't.003.rnm.log', 't.agg.npz', 't.rnm.json']
@@ -0,0 +1,55 @@
+import os
+import re
+import sys
+import filecmp
+import subprocess
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_KINFOLD = f'{sys.executable} {os.path.join(ROOT, "benchmarks", "fake_kinfold.py")}'
+FASTA = '>t\nUUAGUUGUGCCGCAGCGAAGUAGUGCUUGAAAUAUGCGAC\n'
+
+
+def drkinfold(cwd, *args, check = True):
+    """Run DrKinfold with the synthetic Kinfold of the benchmarks."""
+    return subprocess.run([sys.executable, '-m', 'drconverters.drkinfold', 
+                           '--kinfold-exe', FAKE_KINFOLD, '--t-log', '5', *args],
+                          input = FASTA, text = True, cwd = cwd, check = check,
+                          stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+
+
+@pytest.fixture(scope = 'module')
+def reference(tmp_path_factory):
+    cwd = tmp_path_factory.mktemp('reference')
+    drkinfold(cwd, '-p', '3', '-n', '2')
+    return str(cwd / 't.drf')
+
+
+@pytest.mark.parametrize('mode', [['--asyncio'], ['--keep-trajectories'], ['--stream'],
+                                  ['--keep-trajectories', '--binary'],
+                                  ['--keep-trajectories', '--events', '--compress', 'gz'],
+                                  ['--events', '--stream'], ['--no-checkpoint']])
+def test_drkinfold_modes(tmp_path, reference, mode):
+    drkinfold(tmp_path, '-p', '3', '-n', '2', *mode)
+    assert filecmp.cmp(tmp_path / 't.drf', reference, shallow = False)
+    # Combining the existing simulations again gives the same result.
+    drkinfold(tmp_path, '-p', '0', *[m for m in mode if m != '--asyncio'])
+    assert filecmp.cmp(tmp_path / 't.drf', reference, shallow = False)
+
+
+def test_drkinfold_keeps_simulations_in_memory(tmp_path):
+    drkinfold(tmp_path, '-p', '2')
+    assert not [f for f in os.listdir(tmp_path / 'drkinfold') if '.dr' in f]
+    # The checkpoint is the only copy of the simulations.
+    for args in (['--stream'], ['--no-checkpoint'], ['--t-end', '10']):
+        proc = drkinfold(tmp_path, '-p', '0', *args, check = False)
+        assert proc.returncode and 'not stored in trajectory files' in proc.stdout
+
+
+@pytest.mark.parametrize('driver', [[], ['--asyncio']])
+def test_drkinfold_fails_with_kinfold(tmp_path, driver):
+    proc = drkinfold(tmp_path, '-p', '2', *driver, 
+                     '--kinfold-exe', "sh -c 'cat > /dev/null; exit 3'", check = False)
+    assert proc.returncode == 1
+    assert re.search(r'Kinfold call for drkinfold/t\.00[12] failed, see drkinfold/t\.00[12]\.err\.$',
+                     proc.stdout.rstrip())
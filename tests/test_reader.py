@@ -0,0 +1,66 @@
+import os
+import pytest
+
+from drconverters.utils import combine_drfs
+from drconverters.reader import DrfReader, load_drf_index
+
+from test_combine import read_drf
+
+
+@pytest.fixture
+def drffile(tmp_path, times, write_trajectories):
+    pattern = write_trajectories('.drf')
+    combine_drfs(pattern, str(tmp_path / 'out.drf'), times, 
+                 top_k = 2, other = True)
+    return str(tmp_path / 'out.drf')
+
+
+def as_records(records):
+    return [(ni, float(time), occ, ss, en) for ni, time, occ, ss, en in records]
+
+
+def test_reader(drffile, times):
+    expected = [as_records(recs) for recs in read_drf(drffile)]
+    with DrfReader(drffile) as reader:
+        assert len(reader) == len(times)
+        assert [reader.records(i) for i in range(len(reader))] == expected
+        # The closest output time.
+        assert reader.index(times[5] + 1e-6) == 5
+        assert reader.index(-1) == 0 and reader.index(1e9) == len(times) - 1
+        assert reader.at(times[-1]) == expected[-1]
+        window = list(reader.time_range(times[3], times[7]))
+        assert [t for t, _ in window] == pytest.approx(times[3:8])
+        assert [recs for _, recs in window] == expected[3:8]
+        for t in range(len(times)):
+            top = reader.top(times[t], k = 1)
+            structures = [rec for rec in expected[t] if rec[0] >= 0]
+            assert top == [max(structures, key = lambda rec: rec[2])]
+
+
+def test_reader_builds_missing_index(drffile):
+    with DrfReader(drffile) as reader:
+        expected = [reader.records(i) for i in range(len(reader))]
+    os.remove(drffile + '.idx')
+    assert load_drf_index(drffile) is None
+    with DrfReader(drffile) as reader:
+        assert [reader.records(i) for i in range(len(reader))] == expected
+    assert load_drf_index(drffile) is not None
+
+
+def test_reader_without_writable_index(drffile, monkeypatch):
+    with DrfReader(drffile) as reader:
+        expected = [reader.records(i) for i in range(len(reader))]
+    os.remove(drffile + '.idx')
+
+    def read_only(drffile, times, offsets):
+        open(f'{drffile}.idx', 'wb').close()
+        raise PermissionError(f'Read-only: {drffile}.idx')
+    monkeypatch.setattr('drconverters.reader.write_drf_index', read_only)
+    with DrfReader(drffile) as reader:
+        assert [reader.records(i) for i in range(len(reader))] == expected
+    assert not os.path.exists(drffile + '.idx')
+
+
+def test_reader_rejects_compressed_files(tmp_path):
+    with pytest.raises(ValueError):
+        DrfReader(str(tmp_path / 'out.drf.gz'))
@@ -0,0 +1,28 @@
+import sys
+import subprocess
+import pytest
+
+SCRIPTS = ['drconverters.drkinfold', 'drconverters.drkinefold']
+HEAVY = ['numpy', 'asyncio', 'multiprocessing', 'concurrent.futures', 'zstandard', 'RNA']
+
+
+def loaded_modules(code):
+    """Heavy modules loaded after running code in a fresh interpreter."""
+    proc = subprocess.run([sys.executable, '-c', f'{code}\nimport sys\n'
+                           f'print(" ".join(m for m in {HEAVY!r} if m in sys.modules))'],
+                          capture_output = True, text = True, check = True)
+    return proc.stdout.split()
+
+
+@pytest.mark.parametrize('module', SCRIPTS)
+def test_import_is_lightweight(module):
+    assert loaded_modules(f'import {module}') == []
+
+
+@pytest.mark.parametrize('module', SCRIPTS)
+def test_help_is_lightweight(module):
+    code = (f'import sys, contextlib, io, {module}\n'
+            f'sys.argv = ["{module}", "--help"]\n'
+            f'with contextlib.suppress(SystemExit), contextlib.redirect_stdout(io.StringIO()):\n'
+            f'    {module}.main()')
+    assert loaded_modules(code) == []
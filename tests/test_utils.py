@@ -0,0 +1,88 @@
+import os
+import tracemalloc
+import pytest
+
+from drconverters.utils import (get_drf_output_times, combine_drfs, load_drf_checkpoint,
+                                drf_convergence, EnsembleWaves)
+
+
+def test_stream_memory_is_bounded_by_the_buffer(tmp_path, write_trajectories):
+    seqlen = 60
+    times = get_drf_output_times(seqlen, 0.02, 30, 5, 10)
+    pattern = write_trajectories('.drf', nfiles = 4, nsim = 50, 
+                                 times = times, seqlen = seqlen, t_lin = 5)
+    size = sum(os.path.getsize(tmp_path / f) for f in os.listdir(tmp_path))
+    tracemalloc.start()
+    combine_drfs(pattern, str(tmp_path / 'out.drf'), times, 
+                 stream = True, buffersize = 1000)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # All 200 simulations share a buffer of 1000 lines. Buffering all lines
+    # of a simulation takes about twice the size of the files.
+    assert peak < size / 3
+
+
+def test_checkpoint_with_simulations_in_memory(tmp_path, times, write_trajectories):
+    pattern = write_trajectories('.drf', nfiles = 1)
+    checkpoint = str(tmp_path / 'sim.agg.npz')
+    aggregate = combine_drfs(pattern, str(tmp_path / 'out.drf'), times)
+    combine_drfs(pattern, str(tmp_path / 'out.drf'), times, aggregates = [aggregate], 
+                 checkpoint = checkpoint, checkpoint_key = dict(x = 1))
+    # The checkpoint is the only copy of the simulations in memory.
+    with pytest.raises(ValueError):
+        combine_drfs(pattern, str(tmp_path / 'out.drf'), times, 
+                     checkpoint = checkpoint, checkpoint_key = dict(x = 2))
+    with pytest.raises(ValueError):
+        combine_drfs(pattern, str(tmp_path / 'out.drf'), times, stream = True,
+                     checkpoint = checkpoint, checkpoint_key = dict(x = 1))
+    os.remove(tmp_path / 'sim.000.drf')
+    with pytest.raises(ValueError):
+        combine_drfs(pattern, str(tmp_path / 'out.drf'), times, 
+                     checkpoint = checkpoint, checkpoint_key = dict(x = 1))
+
+
+@pytest.mark.parametrize('failure', ['drf', 'npz'])
+def test_checkpoint_survives_failing_outputs(tmp_path, times, write_trajectories, 
+                                             monkeypatch, failure):
+    pattern = write_trajectories('.drf', nfiles = 2)
+    checkpoint = str(tmp_path / 'sim.agg.npz')
+    aggregate = combine_drfs(pattern, str(tmp_path / 'out.drf'), times)
+    oname = str(tmp_path / 'out.drf')
+    if failure == 'drf':
+        oname = str(tmp_path / 'missing' / 'out.drf')
+    else:
+        def save(*args):
+            raise MemoryError
+        monkeypatch.setattr('drconverters.utils.DrfArrays.save', save)
+    with pytest.raises((OSError, MemoryError)):
+        combine_drfs(pattern, oname, times, aggregates = [aggregate], 
+                     arrays = str(tmp_path / 'out.npz'),
+                     checkpoint = checkpoint, checkpoint_key = dict(x = 1))
+    _, _, nsim, files, _, memory = load_drf_checkpoint(checkpoint, dict(x = 1), len(times))
+    assert nsim == 2 * aggregate[2] and memory == aggregate[2] and len(files) == 2
+
+
+def test_drf_convergence():
+    cdict = [{'.': 4}, {'..': 2, '()': 2}]
+    se, tv = drf_convergence(cdict, 4)
+    assert se == pytest.approx(0.25) and tv == float('inf')
+    assert drf_convergence(cdict, 4, ([{'.': 2}, {'..': 1, '()': 1}], 2))[1] == 0
+    assert drf_convergence(cdict, 4, ([{'.': 2}, {'..': 2}], 2))[1] == 1
+
+
+@pytest.mark.parametrize('unique, waves', [(False, 2), (True, 10)])
+def test_ensemble_waves(unique, waves):
+    # Ten simulations per wave, all in the same or all in distinct structures.
+    ensemble = EnsembleWaves(['x'], tolerance = 0.2, convergence = 'tv', time_budget = 1e9)
+    cdict, nsim = [dict()], 0
+    for pending in ensemble:
+        if ensemble.wave == 10:
+            break
+        assert pending == ['x']
+        for i in range(10):
+            ss = f'{nsim}' if unique else '.'
+            cdict = [dict(cdict[0], **{ss: cdict[0].get(ss, 0) + 1})]
+            nsim += 1
+        ensemble.update('x', cdict, nsim)
+    assert ensemble.wave == waves
+    assert ensemble.pending == ([] if waves < 10 else ['x'])